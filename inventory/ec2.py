@@ -158,8 +158,14 @@ These settings would produce a destination_format as the following:
 import sys
 import os
 import argparse
+import hashlib
 import re
-from time import time
+import shutil
+import sqlite3
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep, time
 from copy import deepcopy
 import boto
 from boto import ec2
@@ -190,12 +196,14 @@ DEFAULTS = {
     'all_elasticache_replication_groups': 'False',
     'all_instances': 'False',
     'all_rds_instances': 'False',
+    'api_calls_per_second': '0',
     'aws_access_key_id': '',
     'aws_secret_access_key': '',
     'aws_security_token': '',
     'boto_profile': '',
     'cache_max_age': '300',
     'cache_path': '~/.ansible/tmp',
+    'concurrency': '1',
     'destination_variable': 'public_dns_name',
     'elasticache': 'True',
     'eucalyptus': 'False',
@@ -221,6 +229,7 @@ DEFAULTS = {
     'group_by_tag_keys': 'True',
     'group_by_tag_none': 'True',
     'group_by_vpc_id': 'True',
+    'host_cache_max_age': '',
     'hostname_variable': '',
     'iam_role': '',
     'include_rds_clusters': 'False',
@@ -238,6 +247,78 @@ DEFAULTS = {
     'vpc_destination_variable': 'ip_address'
 }
 
+# Node definitions of the generated testbed, merged into the hostvars as testbed_config
+TESTBED_FILE = 'testbed/testbed_definition.yml'
+
+
+class RateLimiter(object):
+    ''' Spaces out calls from any number of threads to at most rate per second '''
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.next_call = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            sleep(delay)
+
+
+class HostCache(object):
+    ''' SQLite table of the hostvars of every host, each entry with its own
+    expiry time, so --host reads one row instead of the whole inventory '''
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = None
+
+    def connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, timeout=30)
+            # Readers of other inventory runs are not blocked while a refresh writes
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS hosts (name TEXT PRIMARY KEY, region TEXT, '
+                                    'resource_id TEXT, hostvars TEXT, expires REAL)')
+        return self.connection
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def get(self, name):
+        ''' Returns (region, resource ID, hostvars, expires) of a host or None '''
+        if not self.exists():
+            return None
+        row = self.connect().execute('SELECT region, resource_id, hostvars, expires FROM hosts WHERE name = ?',
+                                     (name,)).fetchone()
+        if row is None:
+            return None
+        region, resource_id, hostvars, expires = row
+        return region, resource_id, json.loads(hostvars), expires
+
+    def put(self, name, region, resource_id, hostvars, max_age):
+        with self.connect() as connection:
+            connection.execute('INSERT OR REPLACE INTO hosts VALUES (?, ?, ?, ?, ?)',
+                               (name, region, resource_id, json.dumps(hostvars), time() + max_age))
+
+    def delete(self, name):
+        with self.connect() as connection:
+            connection.execute('DELETE FROM hosts WHERE name = ?', (name,))
+
+    def replace_all(self, index, hostvars, max_age):
+        ''' Replaces all entries in one transaction with the hosts of a full refresh '''
+        expires = time() + max_age
+        with self.connect() as connection:
+            connection.execute('DELETE FROM hosts')
+            connection.executemany('INSERT OR REPLACE INTO hosts VALUES (?, ?, ?, ?, ?)', (
+                (name, region, resource_id, json.dumps(hostvars.get(name, {})), expires)
+                for name, (region, resource_id) in index.items()))
+
 
 class Ec2Inventory(object):
 
@@ -247,12 +328,8 @@ class Ec2Inventory(object):
     def __init__(self):
         ''' Main execution path '''
 
-        # Load topology configuration to merge into instance information later on
-        self.testbed_topology = None
-        TESTBED_FILE = 'testbed/testbed_definition.yml'
-        if os.path.isfile(TESTBED_FILE):
-            with open(TESTBED_FILE, 'r') as file:
-                self.testbed_topology = yaml.safe_load(file)
+        # Testbed node configurations by machine name, loaded on first use (see get_testbed_config)
+        self.testbed_nodes = None
 
         # Inventory grouped by instance IDs, tags, security groups, regions,
         # and availability zones
@@ -263,6 +340,9 @@ class Ec2Inventory(object):
         # Index of hostname (address) to instance ID
         self.index = {}
 
+        # Pool for parallel tag requests while the cache is refreshed
+        self.tag_pool = None
+
         # Boto profile to use (if any)
         self.boto_profile = None
 
@@ -279,10 +359,10 @@ class Ec2Inventory(object):
             if not hasattr(boto.ec2.EC2Connection, 'profile_name'):
                 self.fail_with_error("boto version must be >= 2.24 to use profile")
 
-        # Cache
+        # Cache, --host checks the expiry of its own entry only
         if self.args.refresh_cache:
             self.do_api_calls_update_cache()
-        elif not self.is_cache_valid():
+        elif not self.args.host and not self.is_cache_valid():
             self.do_api_calls_update_cache()
 
         # Data to print
@@ -292,8 +372,10 @@ class Ec2Inventory(object):
         elif self.args.list:
             # Display list of instances for inventory
             if self.inventory == self._empty_inventory():
-                data_to_print = self.get_inventory_from_cache()
+                self.print_inventory_from_cache()
+                return
             else:
+                self.add_testbed_configs(self.inventory['_meta']['hostvars'])
                 data_to_print = self.json_format_dict(self.inventory, True)
 
         print(data_to_print)
@@ -305,7 +387,7 @@ class Ec2Inventory(object):
             mod_time = os.path.getmtime(self.cache_path_cache)
             current_time = time()
             if (mod_time + self.cache_max_age) > current_time:
-                if os.path.isfile(self.cache_path_index):
+                if self.host_cache.exists():
                     return True
 
         return False
@@ -470,10 +552,17 @@ class Ec2Inventory(object):
         cache_id = self.boto_profile or os.environ.get('AWS_ACCESS_KEY_ID', self.credentials.get('aws_access_key_id'))
         if cache_id:
             cache_name = '%s-%s' % (cache_name, cache_id)
-        cache_name += '-' + str(abs(hash(__file__)))[1:7]
+        # hash() of a str differs between interpreter runs, which made every run miss the cache
+        cache_name += '-' + hashlib.sha1(os.path.abspath(__file__).encode('utf-8')).hexdigest()[:6]
         self.cache_path_cache = os.path.join(cache_dir, "%s.cache" % cache_name)
-        self.cache_path_index = os.path.join(cache_dir, "%s.index" % cache_name)
+        self.host_cache = HostCache(os.path.join(cache_dir, "%s.hosts.sqlite" % cache_name))
         self.cache_max_age = config.getint('ec2', 'cache_max_age')
+        host_cache_max_age = config.get('ec2', 'host_cache_max_age')
+        self.host_cache_max_age = int(host_cache_max_age) if host_cache_max_age else self.cache_max_age
+
+        # Parallel API requests on cache refresh
+        self.concurrency = max(1, config.getint('ec2', 'concurrency'))
+        self.rate_limiter = RateLimiter(config.getfloat('ec2', 'api_calls_per_second'))
 
         self.expand_csv_tags = config.getboolean('ec2', 'expand_csv_tags')
 
@@ -551,8 +640,19 @@ class Ec2Inventory(object):
         if self.route53_enabled:
             self.get_route53_records()
 
+        # Fetch the instances of all regions in parallel, but add them in region order so the inventory does not
+        # depend on which request finished first. Tag pages get a pool of their own, region workers wait for them.
+        with ThreadPoolExecutor(max_workers=self.concurrency) as region_pool, \
+                ThreadPoolExecutor(max_workers=self.concurrency) as tag_pool:
+            self.tag_pool = tag_pool if self.concurrency > 1 else None
+            fetched = list(region_pool.map(self.fetch_instances_by_region, self.regions))
+        self.tag_pool = None
+
+        for region, instances in zip(self.regions, fetched):
+            for instance in instances:
+                self.add_instance(instance, region)
+
         for region in self.regions:
-            self.get_instances_by_region(region)
             if self.rds_enabled:
                 self.get_rds_instances_by_region(region)
             if self.elasticache_enabled:
@@ -562,7 +662,7 @@ class Ec2Inventory(object):
                 self.include_rds_clusters_by_region(region)
 
         self.write_to_cache(self.inventory, self.cache_path_cache)
-        self.write_to_cache(self.index, self.cache_path_index)
+        self.host_cache.replace_all(self.index, self.inventory['_meta']['hostvars'], self.host_cache_max_age)
 
     def connect(self, region):
         ''' create connection to api server'''
@@ -608,6 +708,20 @@ class Ec2Inventory(object):
         ''' Makes an AWS EC2 API call to the list of instances in a particular
         region '''
 
+        for instance in self.fetch_instances_by_region(region):
+            self.add_instance(instance, region)
+
+    def get_tags_page(self, region, instance_ids):
+        ''' Fetches the tags of up to 199 instances, with its own connection when run in a worker thread '''
+
+        conn = self.connect(region)
+        self.rate_limiter.wait()
+        return conn.get_all_tags(filters={'resource-type': 'instance', 'resource-id': instance_ids})
+
+    def fetch_instances_by_region(self, region):
+        ''' Makes the AWS EC2 API calls for the instances of a region, without
+        adding them to the inventory, so it can run in a worker thread '''
+
         try:
             conn = self.connect(region)
             reservations = []
@@ -616,11 +730,14 @@ class Ec2Inventory(object):
                     filters_dict = {}
                     for filters in self.ec2_instance_filters:
                         filters_dict.update(filters)
+                    self.rate_limiter.wait()
                     reservations.extend(conn.get_all_instances(filters=filters_dict))
                 else:
                     for filters in self.ec2_instance_filters:
+                        self.rate_limiter.wait()
                         reservations.extend(conn.get_all_instances(filters=filters))
             else:
+                self.rate_limiter.wait()
                 reservations = conn.get_all_instances()
 
             # Pull the tags back in a second step
@@ -631,10 +748,15 @@ class Ec2Inventory(object):
                 instance_ids.extend([instance.id for instance in reservation.instances])
 
             max_filter_value = 199
+            pages = [instance_ids[i:i + max_filter_value] for i in range(0, len(instance_ids), max_filter_value)]
             tags = []
-            for i in range(0, len(instance_ids), max_filter_value):
-                tags.extend(conn.get_all_tags(
-                    filters={'resource-type': 'instance', 'resource-id': instance_ids[i:i + max_filter_value]}))
+            if self.tag_pool is not None and len(pages) > 1:
+                for page_tags in list(self.tag_pool.map(lambda page: self.get_tags_page(region, page), pages)):
+                    tags.extend(page_tags)
+            else:
+                for page in pages:
+                    self.rate_limiter.wait()
+                    tags.extend(conn.get_all_tags(filters={'resource-type': 'instance', 'resource-id': page}))
 
             tags_by_instance_id = defaultdict(dict)
             for tag in tags:
@@ -643,10 +765,12 @@ class Ec2Inventory(object):
             if (not self.aws_account_id) and reservations:
                 self.aws_account_id = reservations[0].owner_id
 
+            instances = []
             for reservation in reservations:
                 for instance in reservation.instances:
                     instance.tags = tags_by_instance_id[instance.id]
-                    self.add_instance(instance, region)
+                    instances.append(instance)
+            return instances
 
         except boto.exception.BotoServerError as e:
             if e.error_code == 'AuthFailure':
@@ -1569,15 +1693,56 @@ class Ec2Inventory(object):
 
         instance_vars[self.to_safe('ec2_account_id')] = self.aws_account_id
 
-        # Add testbed topology configuration if set (lookup machine by name tag)
-        if self.testbed_topology:
-            machine_name = instance.tags.get('Name', 'ignore')
-            node_config = next(iter(filter(lambda n: n['name'] == machine_name, self.testbed_topology['nodes'])), None)
-            if node_config is not None:
-                instance_vars['testbed_config'] = node_config
-
         return instance_vars
 
+    def add_testbed_configs(self, hostvars):
+        ''' Adds the testbed topology configuration of every host (looked up
+            by name tag) as testbed_config. It is never part of the caches
+            but added whenever hostvars are served, so --list and --host
+            follow a regenerated testbed right away '''
+
+        for host_vars in hostvars.values():
+            machine_name = host_vars.get('ec2_tag_Name')
+            if not isinstance(machine_name, six.string_types):
+                continue
+            node_config = self.get_testbed_config(machine_name)
+            if node_config is not None:
+                host_vars['testbed_config'] = node_config
+        return hostvars
+
+    def get_testbed_config(self, machine_name):
+        ''' Returns the node configuration of testbed/testbed_definition.yml
+            for a machine name, or None. The file is only read on the first
+            call and indexed by node name, so a cache hit never parses it. '''
+
+        if self.testbed_nodes is None:
+            self.testbed_nodes = {}
+            if os.path.isfile(TESTBED_FILE):
+                with open(TESTBED_FILE, 'r') as file:
+                    topology = yaml.load(file, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+                sidecars = self.get_testbed_sidecars(topology or {})
+                for node in (topology or {}).get('nodes', []):
+                    if 'machine_id' in node:
+                        node.update(sidecars)
+                    # The first node of a name wins, as with the former linear search
+                    self.testbed_nodes.setdefault(node['name'], node)
+
+        return self.testbed_nodes.get(machine_name)
+
+    def get_testbed_sidecars(self, topology):
+        ''' Returns the absolute paths of the .npy files a compact testbed
+            definition stores the delays, link properties and internal IPs in
+            instead of listing delay_paths per node. Nodes only carry their
+            machine_id and these paths, the tc_rules filter of mockfog_network
+            reads the row of its host from them (see
+            testbed/definition_writer.py) '''
+
+        sidecars = {}
+        for key in ('delay_matrix', 'internal_ips', 'jitter_matrix', 'loss_matrix', 'bandwidth_matrix'):
+            if topology.get(key):
+                sidecars[key] = os.path.abspath(os.path.join(os.path.dirname(TESTBED_FILE), topology[key]))
+        return sidecars
+
     def get_host_info_dict_from_describe_dict(self, describe_dict):
         ''' Parses the dictionary returned by the API call into a flat list
             of parameters. This method should be used only when 'describe' is
@@ -1666,21 +1831,29 @@ class Ec2Inventory(object):
     def get_host_info(self):
         ''' Get variables about a specific host '''
 
-        if len(self.index) == 0:
-            # Need to load index from cache
-            self.load_index_from_cache()
-
-        if self.args.host not in self.index:
-            # try updating the cache
+        entry = self.host_cache.get(self.args.host)
+        if entry is None and len(self.index) == 0:
+            # Unknown host, only a full refresh can tell its instance
             self.do_api_calls_update_cache()
-            if self.args.host not in self.index:
-                # host might not exist anymore
+            entry = self.host_cache.get(self.args.host)
+        if entry is None:
+            # host might not exist anymore
+            return self.json_format_dict({}, True)
+
+        (region, instance_id, host_info, expires) = entry
+        if expires <= time():
+            # Refresh just this instance
+            instance = self.get_instance(region, instance_id)
+            if instance is None:
+                self.host_cache.delete(self.args.host)
                 return self.json_format_dict({}, True)
-
-        (region, instance_id) = self.index[self.args.host]
-
-        instance = self.get_instance(region, instance_id)
-        return self.json_format_dict(self.get_host_info_dict_from_instance(instance), True)
+            ansible_host = host_info.get('ansible_host')
+            host_info = self.get_host_info_dict_from_instance(instance)
+            if ansible_host is not None:
+                host_info['ansible_host'] = ansible_host
+            self.host_cache.put(self.args.host, region, instance_id, host_info, self.host_cache_max_age)
+        self.add_testbed_configs({self.args.host: host_info})
+        return self.json_format_dict(host_info, True)
 
     def push(self, my_dict, key, element):
         ''' Push an element onto an array that may not have been defined in
@@ -1709,18 +1882,37 @@ class Ec2Inventory(object):
             json_inventory = f.read()
             return json_inventory
 
-    def load_index_from_cache(self):
-        ''' Reads the index from the cache file sets self.index '''
+    def print_inventory_from_cache(self):
+        ''' Prints the cached inventory with the testbed_config of every
+        host. Without a testbed definition the cache file is copied to stdout
+        as is, without decoding or parsing it '''
 
-        with open(self.cache_path_index, 'rb') as f:
-            self.index = json.load(f)
+        if os.path.isfile(TESTBED_FILE):
+            inventory = json.loads(self.get_inventory_from_cache())
+            self.add_testbed_configs(inventory['_meta']['hostvars'])
+            print(self.json_format_dict(inventory, True))
+            return
+
+        sys.stdout.flush()
+        with open(self.cache_path_cache, 'rb') as f:
+            shutil.copyfileobj(f, sys.stdout.buffer, 1 << 20)
+        sys.stdout.buffer.write(b'\n')
+        sys.stdout.flush()
 
     def write_to_cache(self, data, filename):
-        ''' Writes data in JSON format to a file '''
+        ''' Writes data in JSON format to a file, replacing it atomically so
+        concurrent inventory runs never read a partial file '''
 
         json_data = self.json_format_dict(data, True)
-        with open(filename, 'w') as f:
-            f.write(json_data)
+        handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(filename), prefix='.' + os.path.basename(filename))
+        try:
+            with os.fdopen(handle, 'w') as f:
+                f.write(json_data)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, filename)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
 
     def uncammelize(self, key):
         temp = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', key)
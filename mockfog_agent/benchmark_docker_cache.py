@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""
+Measures the latency of container updates through mockfog_agent.Docker with and without the handle cache.
+
+A local fake Docker Engine API (stdlib HTTP server) answers container inspects and updates after --api-latency
+seconds and keeps the events stream open, the real Docker SDK talks to it over TCP. Every update without the cache
+costs an inspect and an update round-trip, with the cache only the update.
+
+Usage: python benchmark_docker_cache.py [--updates 500] [--containers 10] [--api-latency 0.001]
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import docker
+
+import mockfog_agent
+
+API_VERSION = '1.41'
+
+
+class FakeDockerApi(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    latency = 0
+    requests = {}
+    requests_lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _count(self, kind):
+        with FakeDockerApi.requests_lock:
+            FakeDockerApi.requests[kind] = FakeDockerApi.requests.get(kind, 0) + 1
+
+    def _send_json(self, value, status=200):
+        body = json.dumps(value).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path.endswith('/events'):
+            # Stream headers only, the benchmark does not change any container
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            self.wfile.flush()
+            threading.Event().wait()
+            return
+        match = re.match(r'/v[\d.]+/containers/([^/]+)/json$', path)
+        if match:
+            self._count('inspect')
+            time.sleep(FakeDockerApi.latency)
+            name = match.group(1)
+            self._send_json({'Id': 'id-' + name, 'Name': '/' + name})
+            return
+        self._send_json({'message': 'not found'}, 404)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if re.match(r'/v[\d.]+/containers/([^/]+)/update$', self.path):
+            self._count('update')
+            time.sleep(FakeDockerApi.latency)
+            self._send_json({'Warnings': []})
+            return
+        self._send_json({'message': 'not found'}, 404)
+
+
+def measure(port, cache_handles, updates, containers):
+    client = docker.DockerClient(base_url='tcp://127.0.0.1:{}'.format(port), version=API_VERSION)
+    wrapper = mockfog_agent.Docker(mockfog_agent.AgentStatus(), client=client, cache_handles=cache_handles)
+    # Wait for the events stream, handles are only cached while it is connected
+    deadline = time.time() + 5
+    while cache_handles and not wrapper._caching and time.time() < deadline:
+        time.sleep(0.01)
+
+    FakeDockerApi.requests = {}
+    latencies = []
+    for update in range(updates):
+        start = time.perf_counter()
+        wrapper.update('container{}'.format(update % containers), cpu_shares=512 + update % 512)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return latencies, dict(FakeDockerApi.requests)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the container handle cache of the agent')
+    parser.add_argument('--updates', type=int, default=500, help='Updates per run (default: 500)')
+    parser.add_argument('--containers', type=int, default=10, help='Distinct containers updated (default: 10)')
+    parser.add_argument('--api-latency', type=float, default=0.001,
+                        help='Seconds the fake daemon takes per request (default: 0.001)')
+    args = parser.parse_args()
+
+    FakeDockerApi.latency = args.api_latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeDockerApi)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    print('{:>10} {:>10} {:>10} {:>10} {:>10}'.format('cache', 'p50 [ms]', 'p99 [ms]', 'inspects', 'updates'))
+    for cache_handles in (False, True):
+        latencies, requests = measure(port, cache_handles, args.updates, args.containers)
+        print('{:>10} {:>10.3f} {:>10.3f} {:>10} {:>10}'.format(
+            'on' if cache_handles else 'off', latencies[len(latencies) // 2] * 1e3,
+            latencies[int(len(latencies) * 0.99)] * 1e3, requests.get('inspect', 0), requests.get('update', 0)))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+"""
+Drives a local agent with many concurrent controller connections.
+
+Docker and tc are replaced by stubs that only sleep for a configurable latency, so the test runs anywhere and
+measures the agent itself: request throughput, latency percentiles and whether every scheduled action ran.
+
+Usage: python load_test.py [--clients 200] [--requests 20] [--docker-latency 0.05] [--tc-latency 0.05]
+"""
+
+import argparse
+import http.client
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import mockfog_agent
+
+
+class FakeContainer(object):
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def update(self, **kwargs):
+        time.sleep(self.client.latency)
+        with self.client.lock:
+            self.client.updates += 1
+
+
+class FakeCollection(object):
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, name):
+        time.sleep(self.client.latency)
+        return FakeContainer(self.client, name)
+
+    def list(self):
+        return []
+
+
+class FakeDockerClient(object):
+    """ Stands in for docker.DockerClient, every daemon call takes latency seconds. """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.updates = 0
+        self.containers = FakeCollection(self)
+        self.networks = FakeCollection(self)
+
+    def events(self, decode=False, filters=None):
+        # Nothing ever changes, keep the stream open so the agent caches container handles
+        threading.Event().wait()
+        return iter(())
+
+
+class StubTc(mockfog_agent.Tc):
+    """ Tc without any processes, applying a rule set takes latency seconds. """
+
+    def __init__(self, status, latency):
+        super().__init__(status)
+        self.latency = latency
+        self.batches = 0
+
+    def apply_batch(self, commands):
+        time.sleep(self.latency)
+        self.batches += 1
+        return True
+
+    def reset_interface(self, interface):
+        self._configured.discard(interface)
+
+    def disable(self, interface):
+        self.status.get_interface().set_active('false')
+
+    def enable(self, interface):
+        self.status.get_interface().set_active('true')
+
+
+def run_client(port, client_id, requests):
+    """ Sends requests over one keep-alive connection, alternating event uploads and report reads. """
+    latencies = []
+    errors = 0
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    for request_id in range(requests):
+        start = time.perf_counter()
+        try:
+            if request_id % 2 == 0:
+                path = '/application' if request_id % 4 == 0 else '/interface'
+                data = {'name': 'container%d' % client_id, 'cpu': 512, 'memory': '128m'} \
+                    if path == '/application' else {'id': 'eth1', 'delay': '10ms', 'active': True}
+                body = json.dumps([{'id': request_id, 'timestamp': int(time.time() * 1000), 'data': data}])
+                connection.request('POST', path, body, {'Content-Type': 'application/json'})
+            else:
+                connection.request('GET', '/reports/0')
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        latencies.append(time.perf_counter() - start)
+    connection.close()
+    return latencies, errors
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the agent with stubbed Docker and tc backends')
+    parser.add_argument('--clients', type=int, default=200, help='Concurrent connections (default: 200)')
+    parser.add_argument('--requests', type=int, default=20, help='Requests per connection (default: 20)')
+    parser.add_argument('--docker-latency', type=float, default=0.05,
+                        help='Seconds per stubbed Docker call (default: 0.05)')
+    parser.add_argument('--tc-latency', type=float, default=0.05,
+                        help='Seconds per stubbed tc batch (default: 0.05)')
+    args = parser.parse_args()
+
+    docker_client = FakeDockerClient(args.docker_latency)
+    agent = mockfog_agent.Agent(docker_client=docker_client)
+    agent.tc = StubTc(agent.status, args.tc_latency)
+    server = mockfog_agent.make_server(agent, port=0, address='127.0.0.1')
+    # Silence the per-request access log
+    mockfog_agent.WebServerHandler.log_message = lambda *args: None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as clients:
+        results = list(clients.map(lambda client_id: run_client(port, client_id, args.requests),
+                                   range(args.clients)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for client_latencies, _ in results for latency in client_latencies)
+    errors = sum(client_errors for _, client_errors in results)
+    print('requests:    %d (%d errors) in %.2fs, %.0f req/s' % (len(latencies), errors, elapsed,
+                                                              len(latencies) / elapsed))
+    print('latency:     p50 %.1fms  p95 %.1fms  p99 %.1fms  max %.1fms' % tuple(
+        percentile(latencies, fraction) * 1e3 for fraction in (0.5, 0.95, 0.99, 1.0)))
+
+    # Scheduled actions run on the worker pools after the responses have been sent
+    time.sleep(0.5)
+    agent.docker_pool.shutdown(wait=True)
+    agent.tc_pool.shutdown(wait=True)
+    print('docker:      %d container updates' % docker_client.updates)
+    print('tc:          %d rule set batches' % agent.tc.batches)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
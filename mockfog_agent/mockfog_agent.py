@@ -1,16 +1,83 @@
+import argparse
+import bisect
+import heapq
+import itertools
 import json
 import logging
+import os
 import re
-import sched
 import subprocess
 import threading
 import time
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from io import BytesIO
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlsplit
 
 import docker
 import docker.errors
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Snapshots are immutable copies of the agent status taken for a report. Fields are declared without defaults,
+# dataclasses only allow __slots__ in that case before Python 3.10.
+
+@dataclass(frozen=True)
+class ContainerSnapshot:
+    __slots__ = ('memory_limit', 'cpu_shares')
+    memory_limit: str
+    cpu_shares: str
+
+    def to_dict(self):
+        return {"memory_limit": self.memory_limit, "cpu_shares": self.cpu_shares}
+
+
+@dataclass(frozen=True)
+class InterfaceSnapshot:
+    __slots__ = ('id', 'bandwidth', 'latency', 'packet_loss', 'active')
+    id: str
+    bandwidth: str
+    latency: str
+    packet_loss: str
+    active: str
+
+    def to_dict(self):
+        return {"id": self.id, "bandwidth": self.bandwidth, "latency": self.latency,
+                "packet_loss": self.packet_loss, "active": self.active}
+
+
+@dataclass(frozen=True)
+class AgentSnapshot:
+    __slots__ = ('containers', 'interface')
+    containers: dict
+    interface: InterfaceSnapshot
+
+    def to_dict(self):
+        return {"containers": {name: container.to_dict() for name, container in self.containers.items()},
+                "interface": self.interface.to_dict()}
+
+
+def _to_json_default(value):
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+    raise TypeError("%r is not JSON serializable" % (value,))
+
+
+def dumps(value):
+    """
+    Serialize value (snapshots included) to JSON with orjson if it is installed.
+    :return: bytes
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=_to_json_default)
+    return json.dumps(value, default=_to_json_default, separators=(',', ':')).encode()
+
 
 class ContainerStatus:
     def __init__(self, name):
@@ -34,11 +101,11 @@ class ContainerStatus:
     def set_cpu_shares(self, cpu_shares):
         self.cpu_shares = cpu_shares
 
+    def snapshot(self):
+        return ContainerSnapshot(str(self.memory_limit), str(self.cpu_shares))
+
     def to_json_app(self):
-        return """{
-        "memory_limit": "%s",
-        "cpu_shares": "%s",
-    }""" % (self.memory_limit, self.cpu_shares)
+        return dumps(self.snapshot())
 
 
 class InterfaceStatus:
@@ -80,8 +147,11 @@ class InterfaceStatus:
         self.packet_loss = packet_loss
 
     def update_values(self):
-        """ The result of tcshow looks like the following """
-        """ {
+        """
+        Refresh the cached values from tcshow. Only used by the background poll, reports never fork.
+
+        The result of tcshow looks like the following
+        {
             "docker0": {
                 "outgoing": {
                     "dst-network=192.168.0.10/32, dst-port=8080, protocol=ip": {
@@ -101,8 +171,8 @@ class InterfaceStatus:
                     }
                 }
             }
-        }"""
-
+        }
+        """
         try:
             result = subprocess.run(["tcshow", self.interface], stdout=subprocess.PIPE)
             data = json.loads(result.stdout)
@@ -116,15 +186,13 @@ class InterfaceStatus:
         except:
             print("'tcshow' failed, using saved values")
 
-    def to_json_interface(self):
-        self.update_values()
+    def snapshot(self):
+        # The cached values are updated by Tc whenever the agent applies a change
+        return InterfaceSnapshot(str(self.interface), str(self.bandwidth), str(self.latency), str(self.packet_loss),
+                                 str(self.active))
 
-        return """{
-        "bandwidth": "%s",
-        "latency": "%s",
-        "packet_loss": "%s",
-        "active" : "%s",
-    }""" % (self.bandwidth, self.latency, self.packet_loss, self.active)
+    def to_json_interface(self):
+        return dumps(self.snapshot())
 
 
 class AgentStatus:
@@ -141,77 +209,156 @@ class AgentStatus:
         return self.containers[container_name]
 
     def set_interface(self, interface_id):
-        self.interface = InterfaceStatus(interface_id)
+        # Keep the cached values while the agent keeps changing the same interface
+        if self.interface.get_interface() != interface_id:
+            self.interface = InterfaceStatus(interface_id)
 
     def get_interface(self):
         return self.interface
 
-    def to_json(self):
-        json = "{\n    "
-        i = 0
-
-        if not self.containers:
-            if i != 0:
-                json += ',\n    '
-
-            json += '"%s": ' % ("")
-            json += ContainerStatus("").to_json_app()
-            i += 1
-
-            json += "\n\n    "
-            json += '"%s": ' % (self.get_interface().interface)
-            json += self.get_interface().to_json_interface()
-            i += 1
-            json += "\n}\n"
-            return json
+    def snapshot(self):
+        # list() copies the items in one step, Docker workers may add containers at the same time
+        containers = {name: container.snapshot() for name, container in list(self.containers.items())}
+        return AgentSnapshot(containers, self.interface.snapshot())
 
+    def to_json(self):
+        """
+        Serialize the current status, the interface is only included once.
+        :return: bytes
+        """
+        return dumps(self.snapshot())
 
-        for name, container in self.containers.items():
-            if i != 0:
-                json += ',\n    '
-
-            json += '"%s": ' % (name)
-            json += container.to_json_app()
-            i += 1
-
-            json += "\n\n    "
-            json += '"%s": ' % (self.get_interface().interface)
-            json += self.get_interface().to_json_interface()
-            i += 1
 
-        json += "\n}\n"
-        return json
+class Docker(object):
+    """
+    Wrapper around the Docker SDK that keeps container and network handles by name.
 
+    Cached handles save the lookup round-trip to the daemon. They are dropped when the events stream reports that a
+    name may now refer to another (or no) object; while the stream is down nothing is cached.
+    """
 
-class Docker(object):
-    __docker_client = docker.from_env()
+    # Events after which a cached handle of the object may be stale
+    INVALIDATING_EVENTS = {
+        'container': ('die', 'destroy', 'rename', 'start'),
+        'network': ('create', 'destroy'),
+    }
 
-    def __init__(self, status, name='docker'):
+    def __init__(self, status, name='docker', client=None, max_pool_size=10, cache_handles=True):
+        """
+        :param client: Docker SDK client, defaults to the one configured by the environment
+        :param max_pool_size: connections the default client keeps open, at least the number of parallel updates
+        :param cache_handles: cache container and network handles, invalidated by the Docker events stream
+        """
         self.name = name
         self.status = status
+        # The events stream permanently holds one connection of the pool
+        self.__docker_client = client or docker.from_env(max_pool_size=max_pool_size + 1 if cache_handles
+                                                         else max_pool_size)
+        self._handles = {}
+        self._handles_lock = threading.Lock()
+        # Incremented on every invalidation, so a lookup that raced with an event does not cache its result
+        self._generation = 0
+        self._caching = False
+        if cache_handles:
+            threading.Thread(target=self._watch_events, name='docker-events', daemon=True).start()
+
+    def _watch_events(self):
+        while True:
+            try:
+                events = self.__docker_client.events(decode=True, filters={'type': list(self.INVALIDATING_EVENTS)})
+                self._caching = True
+                for event in events:
+                    self._invalidate(event)
+            except Exception as err:
+                logging.warning("Docker events stream failed, not caching handles: %s", err)
+            with self._handles_lock:
+                self._caching = False
+                self._generation += 1
+                self._handles.clear()
+            time.sleep(1)
+
+    def _invalidate(self, event):
+        kind = event.get('Type')
+        if event.get('Action') not in self.INVALIDATING_EVENTS.get(kind, ()):
+            return
+        actor = event.get('Actor', {})
+        names = {actor.get('Attributes', {}).get('name'), actor.get('Attributes', {}).get('oldName', '').lstrip('/')}
+        with self._handles_lock:
+            self._generation += 1
+            for key, handle in list(self._handles.items()):
+                if key[0] == kind and (key[1] in names or handle.id == actor.get('ID')):
+                    del self._handles[key]
+
+    def _lookup(self, kind, name):
+        """ :return: the handle and whether it came from the cache """
+        key = (kind, name)
+        with self._handles_lock:
+            handle = self._handles.get(key)
+            generation = self._generation
+        if handle is not None:
+            return handle, True
+
+        collection = self.__docker_client.containers if kind == 'container' else self.__docker_client.networks
+        handle = collection.get(name)
+        with self._handles_lock:
+            if self._caching and generation == self._generation:
+                self._handles[key] = handle
+        return handle, False
+
+    def _apply(self, kind, name, operation):
+        """ Run operation(handle), a cached handle that turns out to be stale is looked up once more. """
+        handle, cached = self._lookup(kind, name)
+        try:
+            return operation(handle)
+        except docker.errors.NotFound:
+            if not cached:
+                raise
+            with self._handles_lock:
+                self._handles.pop((kind, name), None)
+            return operation(self._lookup(kind, name)[0])
 
     def run(self, container_image, container_name):
         self.__docker_client.containers.run(image=container_image, name=container_name, detach=True,
                                             cpuset_cpus="0",
                                             mem_limit="256m")
 
-    def update_memory_limit(self, container_name, mem_limit):
+    def update(self, container_name, cpu_shares=None, mem_limit=None):
         """
-        Update the memory limit by container name.
+        Apply several resource changes to a container with a single update call.
         :param container_name:
-        :param mem_limit:
+        :param cpu_shares: see update_cpu_shares, None keeps the current value
+        :param mem_limit: see update_memory_limit, None keeps the current value
         :return:
         """
+        changes = {}
+        if cpu_shares is not None:
+            changes['cpu_shares'] = cpu_shares
+        if mem_limit is not None:
+            changes['mem_limit'] = mem_limit
+            changes['memswap_limit'] = mem_limit
+        if not changes:
+            return
         try:
-            container = self.__docker_client.containers.get(container_name)
-            container.update(mem_limit=mem_limit, memswap_limit=mem_limit)
+            self._apply('container', container_name, lambda container: container.update(**changes))
             self.status.set_container(container_name)
-            self.status.get_container(container_name).set_memory_limit(mem_limit)
+            if cpu_shares is not None:
+                self.status.get_container(container_name).set_cpu_shares(cpu_shares)
+            if mem_limit is not None:
+                self.status.get_container(container_name).set_memory_limit(mem_limit)
         except docker.errors.NotFound:
             logging.warning(container_name + ": not found on this host")
         except docker.errors.APIError as err:
             logging.warning("Failed to update " + container_name, err)
 
+    def update_memory_limit(self, container_name, mem_limit):
+        """
+        Update the memory limit by container name.
+        :param container_name:
+        :param mem_limit:
+        :return:
+        """
+        self.update(container_name, mem_limit=mem_limit)
+
     def update_cpu_shares(self, container_name, cpu_shares):
         """
         Update the cpu shares by container name.
@@ -228,15 +375,7 @@ class Docker(object):
             Specification from https://docs.docker.com/config/containers/resource_constraints/
         :return:
         """
-        try:
-            container = self.__docker_client.containers.get(container_name)
-            container.update(cpu_shares=cpu_shares)
-            self.status.set_container(container_name)
-            self.status.get_container(container_name).set_cpu_shares(cpu_shares)
-        except docker.errors.NotFound:
-            logging.warning(container_name + ": not found on this host")
-        except docker.errors.APIError as err:
-            logging.warning("Failed to update " + container_name, err)
+        self.update(container_name, cpu_shares=cpu_shares)
 
     def connect(self, docker_network, container_name):
         """
@@ -246,8 +385,7 @@ class Docker(object):
         :return:
         """
         try:
-            network = self.__docker_client.networks.get(docker_network)
-            network.connect(container=container_name)
+            self._apply('network', docker_network, lambda network: network.connect(container=container_name))
             self.status.get_container(container_name).set_connection_status(
                 docker_network, "connected")
         except docker.errors.NotFound:
@@ -263,8 +401,7 @@ class Docker(object):
         :return:
         """
         try:
-            network = self.__docker_client.networks.get(docker_network)
-            network.disconnect(container=container_name)
+            self._apply('network', docker_network, lambda network: network.disconnect(container=container_name))
             self.status.get_container(container_name).set_connection_status(
                 docker_network, "disconnected")
         except docker.errors.NotFound:
@@ -283,10 +420,77 @@ class Docker(object):
             container.stop()
 
 
+def to_tc_rate(bandwidth):
+    """
+    Convert a tcset style rate (e.g. 10Mbps, 512Kibit/s, 8bps) to the bit/s notation of tc.
+
+    tc reads "mbps" as megabytes per second, so rates cannot be passed through as they are.
+    :param bandwidth:
+    :return:
+    """
+    match = re.match(r'^\s*([\d.]+)\s*([kKmMgGtT]?)(i?)(bps|bit/s)?\s*$', str(bandwidth))
+    if not match:
+        raise ValueError("invalid bandwidth rate: " + str(bandwidth))
+    value, prefix, binary, _ = match.groups()
+    base = 1024 if binary else 1000
+    exponent = " kmgt".index(prefix.lower()) if prefix else 0
+    return "%dbit" % (float(value) * base ** exponent)
+
+
+def to_tc_delay(delay):
+    """ tcset reads unit-less delays as milliseconds, tc as microseconds. """
+    delay = str(delay).strip()
+    return delay + "ms" if re.match(r'^[\d.]+$', delay) else delay
+
+
+def to_tc_loss(loss):
+    loss = str(loss).strip()
+    return loss if loss.endswith("%") else loss + "%"
+
+
 class Tc(object):
+    # rate of the root class if no bandwidth limit is configured
+    UNLIMITED_RATE = "100gbit"
+
     def __init__(self, status, name='tc'):
         self.name = name
         self.status = status
+        # interfaces that carry the htb root qdisc installed by this agent
+        self._configured = set()
+
+    def apply_batch(self, commands):
+        """
+        Apply tc commands (without the leading "tc") with a single tc process instead of one process per command.
+        :param commands:
+        :return: True if all commands succeeded
+        """
+        batch = "\n".join(commands) + "\n"
+        logging.debug(batch)
+        try:
+            subprocess.run(["tc", "-force", "-batch", "-"], input=batch, universal_newlines=True, check=True)
+            return True
+        except (OSError, subprocess.CalledProcessError) as err:
+            logging.error(err)
+            return False
+
+    def interface_rules(self, interface, bandwidth=None, delay=None, loss=None, root=True):
+        """
+        Build the rule set for an interface: an htb root class limiting the rate and a netem qdisc below it.
+        The class and netem commands use "replace", so applying them again updates the existing rules in place.
+        :param root: include the root qdisc, which htb does not allow to be replaced once it exists
+        :return: list of tc commands
+        """
+        rate = to_tc_rate(bandwidth) if bandwidth else self.UNLIMITED_RATE
+        netem = "netem delay %s" % to_tc_delay(delay or "0ms")
+        if loss:
+            netem += " loss %s" % to_tc_loss(loss)
+        commands = [
+            "class replace dev %s parent 1: classid 1:1 htb rate %s" % (interface, rate),
+            "qdisc replace dev %s parent 1:1 handle 10: %s" % (interface, netem),
+        ]
+        if root:
+            commands.insert(0, "qdisc add dev %s root handle 1: htb default 1" % interface)
+        return commands
 
     def interface(self, interface, **kwargs):
         """
@@ -300,7 +504,7 @@ class Tc(object):
                 bit/s, [kK]bps, [kK]bit/s, [kK]ibps, [kK]ibit/s,
                 [mM]bps, [mM]bit/s, [mM]ibps, [mM]ibit/s, [gG]bps,
                 [gG]bit/s, [gG]ibps, [gG]ibit/s, [tT]bps, [tT]bit/s,
-                [tT]ibps, [tT]ibit/s. e.g. tcset eth0 --rate 10Mbps
+                [tT]ibps, [tT]ibit/s. e.g. 10Mbps
             delay (str): round trip network delay. the valid range is from 0ms
                 to 60min. valid time units are: d/day/days,
                 h/hour/hours, m/min/mins/minute/minutes,
@@ -318,33 +522,31 @@ class Tc(object):
         delay = kwargs.pop('delay', None)
         loss = kwargs.pop('loss', None)
 
-        self.status.set_interface(interface)
-        interface_args = ["tcset", interface]
-        if bandwidth:
-            interface_args.extend(["--rate", bandwidth])
-            self.status.get_interface().set_bandwidth(bandwidth)
-        if delay:
-            interface_args.extend(["--delay", delay])
-            self.status.get_interface().set_latency(delay)
-        if loss:
-            interface_args.extend(["--loss", loss])
-            self.status.get_interface().set_packet_loss(loss)
+        if not (bandwidth or delay or loss):
+            print("command not executed insufficient arguments")
+            return
 
-        # add overwrite flag to be able to update existing rules.
-        interface_args.append("--overwrite")
+        self.status.set_interface(interface)
+        root = interface not in self._configured
         try:
-            # print the executed command arguments
-            print(" ".join(interface_args))
-            logging.debug(" ".join(interface_args))
-            if len(interface_args) > 3:
-                subprocess.run(interface_args, check=True)
-            else:
-                print("command not executed insufficient arguments")
-        except subprocess.CalledProcessError as err:
+            commands = self.interface_rules(interface, bandwidth, delay, loss, root=root)
+        except ValueError as err:
             logging.error(err)
+            return
+
+        if root:
+            # overwrite whatever was configured before the agent took over the interface
+            self.reset_interface(interface)
+
+        # print the executed commands
+        print("\n".join(commands))
+        if self.apply_batch(commands):
+            self._configured.add(interface)
+            # The rules are replaced as a whole, limits missing from this event are back at their defaults
+            self.status.get_interface().set_bandwidth(bandwidth or "")
+            self.status.get_interface().set_latency(delay or "0.0ms")
+            self.status.get_interface().set_packet_loss(loss or "0")
 
-    # TODO: There seems to be an issue with the "--change" flag. It overrides the whole rule instead of updating one
-    #  field.
     def update_bandwidth(self, interface, bandwidth):
         """
         Configure the available bandwidth for the default docker0 interface.
@@ -353,16 +555,17 @@ class Tc(object):
         :param bandwidth:
         :return:
         """
-        subprocess.run(["tcset", interface, "--rate", bandwidth, "--change"], check=True)
+        self.apply_batch(["class change dev %s parent 1: classid 1:1 htb rate %s" % (interface, to_tc_rate(bandwidth))])
 
     def show_rules(self, interface):
         print(subprocess.run(["tcshow", interface], check=True))
 
     def reset_interface(self, interface):
+        self._configured.discard(interface)
         try:
-            subprocess.run(["tcdel", interface, "--all"], check=True)
+            subprocess.run(["tc", "qdisc", "del", "dev", interface, "root"], stderr=subprocess.DEVNULL, check=True)
         except subprocess.CalledProcessError:
-            # TODO: add explanation on why we pass the error here.
+            # there are no rules to delete if the interface still has its default qdisc
             pass
 
     def disable(self, interface):
@@ -391,91 +594,731 @@ class Tc(object):
             logging.warning("Insufficient permissions")
 
 
+class Histogram(object):
+    """ Cumulative histogram in the Prometheus sense: counts per upper bound plus sum and count. """
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics(object):
+    """
+    Timing of scheduled events, all durations in seconds on the monotonic clock.
+
+    - dispatch_lag: scheduler fired the event after its planned time
+    - start_lag: backend worker started the action after the planned time, includes queueing on the pool
+    - action_duration: time the Docker or tc action took
+    The most recent actions are also kept individually with their planned time.
+    """
+
+    BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+    def __init__(self, recent=1000):
+        self._histograms = OrderedDict()
+        self._recent = deque(maxlen=recent)
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, backend=None):
+        key = (name, backend)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.BOUNDS)
+            histogram.observe(value)
+
+    def timed(self, backend, target, planned, action, *args, **kwargs):
+        """
+        Run action(*args, **kwargs) and record its start lag and duration.
+        :param planned: monotonic time the action was scheduled for
+        """
+        started = time.monotonic()
+        try:
+            return action(*args, **kwargs)
+        finally:
+            finished = time.monotonic()
+            self.observe('start_lag', started - planned, backend)
+            self.observe('action_duration', finished - started, backend)
+            self._recent.append({"backend": backend, "target": target,
+                                 "planned": int((planned + time.time() - finished) * 1000),
+                                 "start_lag": started - planned, "duration": finished - started})
+
+    def recent(self):
+        return list(self._recent)
+
+    def to_prometheus(self):
+        """ :return: all histograms in the Prometheus text exposition format """
+        lines = []
+        with self._lock:
+            histograms = [(key, histogram.counts[:], histogram.sum, histogram.count)
+                          for key, histogram in self._histograms.items()]
+        # The samples of a metric family have to be contiguous, backends of a name keep their insertion order
+        histograms.sort(key=lambda histogram: histogram[0][0])
+        described = set()
+        for (name, backend), counts, total, count in histograms:
+            metric = 'mockfog_agent_event_%s_seconds' % name
+            if metric not in described:
+                described.add(metric)
+                lines.append('# TYPE %s histogram' % metric)
+            labels = 'backend="%s"' % backend if backend else ''
+            cumulative = 0
+            for bound, bucket in zip(self.BOUNDS + ('+Inf',), counts):
+                cumulative += bucket
+                lines.append('%s_bucket{%sle="%s"} %d' % (metric, labels + ',' if labels else '', bound, cumulative))
+            labels = '{%s}' % labels if labels else ''
+            lines.append('%s_sum%s %.6f' % (metric, labels, total))
+            lines.append('%s_count%s %d' % (metric, labels, count))
+        return '\n'.join(lines) + '\n'
+
+
+class KeyedExecutor(object):
+    """
+    Thread pool that runs tasks with the same key one after another in submission order, tasks with different keys
+    in parallel.
+
+    Every worker is a single thread with its own queue. A key sticks to one worker while it has tasks queued or
+    running there, otherwise it is assigned to the worker with the fewest tasks.
+    """
+
+    def __init__(self, max_workers, thread_name_prefix=''):
+        self._workers = [ThreadPoolExecutor(max_workers=1, thread_name_prefix='%s-%d' % (thread_name_prefix, index))
+                         for index in range(max_workers)]
+        self._load = [0] * max_workers
+        # key -> (worker index, number of its tasks not finished yet)
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn, *args, **kwargs):
+        with self._lock:
+            worker, tasks = self._keys.get(key, (None, 0))
+            if worker is None:
+                worker = min(range(len(self._workers)), key=self._load.__getitem__)
+            self._keys[key] = (worker, tasks + 1)
+            self._load[worker] += 1
+            # Still under the lock, so tasks of a key enter the worker queue in the order they were submitted
+            future = self._workers[worker].submit(fn, *args, **kwargs)
+        future.add_done_callback(lambda _: self._finished(key, worker))
+        return future
+
+    def _finished(self, key, worker):
+        with self._lock:
+            self._load[worker] -= 1
+            tasks = self._keys[key][1] - 1
+            if tasks:
+                self._keys[key] = (worker, tasks)
+            else:
+                del self._keys[key]
+
+    def shutdown(self, wait=True):
+        for worker in self._workers:
+            worker.shutdown(wait=wait)
+
+
+class DockerUpdateBatch(object):
+    """
+    Collects the container changes of all events scheduled for the same instant.
+
+    Changes to the same container are merged (later events win), flush() then applies one update per container.
+    The updates of different containers run in parallel on the Docker workers, updates of the same container from
+    consecutive instants are applied in order (see KeyedExecutor).
+    """
+
+    def __init__(self, docker_client, pool, metrics):
+        """ :param pool: KeyedExecutor, updates are keyed by container name """
+        self.docker = docker_client
+        self.pool = pool
+        self.metrics = metrics
+        self._pending = OrderedDict()
+        self._planned = {}
+        self._lock = threading.Lock()
+
+    def add(self, container_name, planned, **changes):
+        """ :param planned: monotonic time the change was scheduled for """
+        with self._lock:
+            self._pending.setdefault(container_name, {}).update(
+                (key, value) for key, value in changes.items() if value is not None)
+            self._planned[container_name] = min(planned, self._planned.get(container_name, planned))
+
+    def flush(self):
+        """ :return: futures of the submitted updates """
+        with self._lock:
+            pending, self._pending = self._pending, OrderedDict()
+            planned, self._planned = self._planned, {}
+        return [self.pool.submit(container_name, self.metrics.timed, 'docker', container_name,
+                                 planned[container_name], self.docker.update, container_name, **changes)
+                for container_name, changes in pending.items()]
+
+
+class ScheduledEvent(object):
+    __slots__ = ('id', 'time', 'sequence', 'action', 'args', 'info')
+
+    def __init__(self, event_id, when, sequence, action, args, info):
+        self.id = event_id
+        self.time = when
+        self.sequence = sequence
+        self.action = action
+        self.args = args
+        self.info = info
+
+    def to_dict(self, offset=0.0):
+        """ :param offset: added to the scheduled time to get the wall-clock time """
+        return dict(self.info, id=self.id, timestamp=int((self.time + offset) * 1000))
+
+
+class EventScheduler(object):
+    """
+    Long-lived scheduler shared by all requests: a heap of pending events served by a single dispatch thread.
+
+    Cancelled and rescheduled events leave their old heap entry behind, it is skipped when it reaches the top
+    (its sequence number no longer matches) and the heap is compacted once most of it is stale.
+
+    Events due at the same time are dispatched together, afterwards the hooks added with add_instant_hook() run,
+    e.g. to apply the changes collected from these events at once.
+
+    Timestamps passed in and returned are wall-clock times as used by the controller. Internally they are mapped to
+    the monotonic clock with the offset between both clocks taken when the scheduler starts, so clock adjustments
+    (NTP) do not move pending events and equal timestamps stay equal, keeping the events of an instant together. The
+    thread sleeps until shortly before an event is due and yields in a loop for the last SPIN seconds, which keeps
+    dispatch within a fraction of a millisecond of the planned time.
+    """
+
+    SPIN = 0.002
+
+    def __init__(self, timefunc=time.monotonic, metrics=None):
+        """
+        :param timefunc: monotonic clock the events are dispatched on
+        :param metrics: Metrics that receive the dispatch lag of every event
+        """
+        self._timefunc = timefunc
+        self.metrics = metrics
+        self.current_event = None
+        self._instant_hooks = []
+        self._queue = []
+        self._events = {}
+        self._stale = 0
+        self._ids = itertools.count(1)
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        # Wall-clock minus monotonic time
+        self._offset = time.time() - timefunc()
+        self._thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+        self._thread.start()
+
+    def enterabs(self, when, action, args=(), info=None):
+        """
+        Schedule action(*args) at the absolute wall-clock time when.
+        :param info: dict describing the event, returned by pending()
+        :return: event id
+        """
+        return self._enter(when - self._offset, action, args, info)
+
+    def enter(self, delay, action, args=(), info=None):
+        """ Schedule action(*args) delay seconds from now, :return: event id """
+        return self._enter(self._timefunc() + delay, action, args, info)
+
+    def _enter(self, when, action, args, info):
+        """ :param when: monotonic time """
+        with self._condition:
+            event = ScheduledEvent(next(self._ids), when, next(self._sequence), action, args, info or {})
+            self._events[event.id] = event
+            heapq.heappush(self._queue, (event.time, event.sequence, event.id))
+            self._condition.notify()
+            return event.id
+
+    def cancel(self, event_id):
+        """ :return: False if the event is unknown or has already run """
+        with self._condition:
+            if self._events.pop(event_id, None) is None:
+                return False
+            self._discard_entry()
+            return True
+
+    def reschedule(self, event_id, when):
+        """ :return: False if the event is unknown or has already run """
+        with self._condition:
+            event = self._events.get(event_id)
+            if event is None:
+                return False
+            event.time = when - self._offset
+            event.sequence = next(self._sequence)
+            heapq.heappush(self._queue, (event.time, event.sequence, event.id))
+            self._discard_entry()
+            self._condition.notify()
+            return True
+
+    def add_instant_hook(self, hook):
+        """ Call hook() after all events of a scheduled instant have run. """
+        self._instant_hooks.append(hook)
+
+    def pending(self):
+        """ :return: all pending events ordered by their scheduled time """
+        with self._condition:
+            return [event.to_dict(self._offset)
+                    for event in sorted(self._events.values(), key=lambda e: (e.time, e.sequence))]
+
+    def _discard_entry(self):
+        self._stale += 1
+        if self._stale > len(self._events):
+            self._queue = [(event.time, event.sequence, event.id) for event in self._events.values()]
+            heapq.heapify(self._queue)
+            self._stale = 0
+
+    def _pop_valid(self):
+        """ Drop stale entries from the top of the heap, :return: the first valid entry or None """
+        while self._queue:
+            when, sequence, event_id = self._queue[0]
+            event = self._events.get(event_id)
+            if event is not None and event.sequence == sequence:
+                return event
+            heapq.heappop(self._queue)
+            self._stale = max(0, self._stale - 1)
+        return None
+
+    def _next_events(self):
+        """ Wait for the next due instant, :return: all events scheduled for it in order """
+        with self._condition:
+            while True:
+                event = self._pop_valid()
+                if event is None:
+                    self._condition.wait()
+                    continue
+                delay = event.time - self._timefunc()
+                if delay > 0:
+                    # wait(0) still releases the lock, so events can be entered while spinning
+                    self._condition.wait(delay - self.SPIN if delay > self.SPIN else 0)
+                    continue
+                when = event.time
+                events = []
+                while event is not None and event.time == when:
+                    heapq.heappop(self._queue)
+                    del self._events[event.id]
+                    events.append(event)
+                    event = self._pop_valid()
+                return events
+
+    def _run(self):
+        while True:
+            for event in self._next_events():
+                if self.metrics is not None:
+                    self.metrics.observe('dispatch_lag', self._timefunc() - event.time)
+                self.current_event = event
+                try:
+                    event.action(*event.args)
+                except Exception:
+                    logging.exception("Scheduled event %d failed", event.id)
+                self.current_event = None
+            for hook in self._instant_hooks:
+                try:
+                    hook()
+                except Exception:
+                    logging.exception("Instant hook failed")
+
+
+class ReportStore(object):
+    """
+    Stage reports with bounded retention.
+
+    Reports are kept as snapshots in memory. Containers that did not change since the previous stage share the
+    snapshot object of that stage instead of storing a copy (delta encoding by structural sharing), so a stage only
+    costs memory for what changed. Once more than max_stages reports are kept or a report is older than max_age
+    seconds, it is dropped, or appended to the spill file if one is configured and read back from there on request.
+    """
+
+    # An hour of stages one second apart, keeps memory bounded in long experiments
+    DEFAULT_MAX_STAGES = 3600
+
+    def __init__(self, max_stages=DEFAULT_MAX_STAGES, max_age=None, spill_path=None):
+        """ :param max_stages: reports kept in memory, None keeps all of them """
+        self.max_stages = max_stages
+        self.max_age = max_age
+        self._stages = OrderedDict()
+        self._previous = None
+        self._lock = threading.Lock()
+        # stage id -> (timestamp, offset, length) of the report in the spill file
+        self._spilled = OrderedDict()
+        self._spill = open(spill_path, 'ab+') if spill_path else None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._stages) + len(self._spilled)
+
+    def _delta(self, snapshot):
+        previous = self._previous
+        if previous is None:
+            return snapshot
+        containers = {}
+        for name, container in snapshot.containers.items():
+            unchanged = previous.containers.get(name)
+            containers[name] = unchanged if unchanged == container else container
+        interface = previous.interface if previous.interface == snapshot.interface else snapshot.interface
+        return AgentSnapshot(containers, interface)
+
+    def _evict(self, now):
+        while self._stages:
+            stage_id, (timestamp, snapshot) = next(iter(self._stages.items()))
+            too_many = self.max_stages is not None and len(self._stages) > self.max_stages
+            too_old = self.max_age is not None and timestamp < now - self.max_age
+            if not (too_many or too_old):
+                break
+            del self._stages[stage_id]
+            if self._spill is not None:
+                self._spill_report(stage_id, timestamp, snapshot)
+
+    def _spill_report(self, stage_id, timestamp, snapshot):
+        # One JSON line per stage, the index remembers where the report itself starts
+        prefix = b'{"stage":' + dumps(stage_id) + b',"timestamp":' + dumps(int(timestamp * 1000)) + b',"report":'
+        report = dumps(snapshot)
+        self._spill.seek(0, os.SEEK_END)
+        offset = self._spill.tell() + len(prefix)
+        self._spill.write(prefix + report + b'}\n')
+        self._spill.flush()
+        self._spilled.pop(stage_id, None)
+        self._spilled[stage_id] = (timestamp, offset, len(report))
+
+    def initialize(self, stage_id, snapshot):
+        """ Store the report of the initial stage unless reports have been stored before. """
+        with self._lock:
+            if self._previous is None:
+                self._add(stage_id, snapshot)
+
+    def add(self, stage_id, snapshot):
+        with self._lock:
+            self._add(stage_id, snapshot)
+
+    def _add(self, stage_id, snapshot):
+        now = time.time()
+        snapshot = self._delta(snapshot)
+        self._stages.pop(stage_id, None)
+        self._spilled.pop(stage_id, None)
+        self._stages[stage_id] = (now, snapshot)
+        self._previous = snapshot
+        self._evict(now)
+
+    def get(self, stage_id):
+        """ :return: the report as JSON bytes, None if the stage is unknown or has been dropped """
+        with self._lock:
+            if stage_id in self._stages:
+                return dumps(self._stages[stage_id][1])
+            if stage_id in self._spilled:
+                _, offset, length = self._spilled[stage_id]
+                self._spill.seek(offset)
+                return self._spill.read(length)
+        return None
+
+    def stages(self):
+        """ :return: id and capture time of all retrievable stages, oldest first """
+        with self._lock:
+            entries = [(stage_id, timestamp, True) for stage_id, (timestamp, _, _) in self._spilled.items()]
+            entries += [(stage_id, timestamp, False) for stage_id, (timestamp, _) in self._stages.items()]
+        return [{"stage": stage_id, "timestamp": int(timestamp * 1000), "spilled": spilled}
+                for stage_id, timestamp, spilled in entries]
+
+    def range(self, first, last):
+        """
+        Collect the reports of all stages with a numeric id between first and last (inclusive).
+        :return: JSON object bytes mapping stage ids to reports
+        """
+        selected = []
+        for entry in self.stages():
+            try:
+                stage_number = float(entry["stage"])
+            except ValueError:
+                continue
+            if first <= stage_number <= last:
+                selected.append(entry["stage"])
+
+        parts = []
+        for stage_id in selected:
+            report = self.get(stage_id)
+            if report is not None:
+                parts.append(dumps(stage_id) + b':' + report)
+        return b'{' + b','.join(parts) + b'}'
+
+
 class Agent(object):
 
-    def __init__(self, name='agent'):
+    def __init__(self, name='agent', docker_client=None, docker_workers=4, tc_workers=1, tc_poll_interval=0,
+                 reports=None):
+        """
+        :param docker_client: Docker SDK client, defaults to the one configured by the environment
+        :param docker_workers: number of Docker operations that may run at the same time
+        :param tc_workers: number of tc operations that may run at the same time, 1 keeps interface changes ordered
+        :param tc_poll_interval: seconds between refreshes of the interface status from tcshow, 0 disables polling
+        :param reports: ReportStore for stage reports, defaults to one keeping the last DEFAULT_MAX_STAGES reports
+        """
         self.status = AgentStatus()
+        self.reports = reports if reports is not None else ReportStore()
         self.name = name
-        self.docker = Docker(self.status)
+        self.docker = Docker(self.status, client=docker_client, max_pool_size=docker_workers)
         self.tc = Tc(self.status)
+        # Scheduled events only queue their work here, so slow daemon calls or forks never delay other events
+        self.docker_pool = KeyedExecutor(docker_workers, thread_name_prefix='docker')
+        self.tc_pool = ThreadPoolExecutor(max_workers=tc_workers, thread_name_prefix='tc')
+        self.metrics = Metrics()
+        self.docker_updates = DockerUpdateBatch(self.docker, self.docker_pool, self.metrics)
+        self.scheduler = EventScheduler(metrics=self.metrics)
+        self.scheduler.add_instant_hook(self.docker_updates.flush)
+
+        self.tc_poll_interval = tc_poll_interval
+        if tc_poll_interval > 0:
+            threading.Thread(target=self._poll_interface, name='tc-poll', daemon=True).start()
+
+    def _poll_interface(self):
+        """ Pick up changes made outside of the agent without forking on the report path. """
+        while True:
+            time.sleep(self.tc_poll_interval)
+            self.tc_pool.submit(self.status.get_interface().update_values)
 
 
 class WebServerHandler(BaseHTTPRequestHandler):
-    _agent = Agent()
-    _stage_report = {}
+    # HTTP/1.1 keeps connections open between requests, so every response needs a Content-Length
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, without TCP_NODELAY the body waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    _agent = None
     _last_scheduled_timestamp = None
 
     @staticmethod
     def _update_report(stage_id):
-        WebServerHandler._stage_report[str(stage_id)] = WebServerHandler._agent.status.to_json()
+        WebServerHandler._agent.reports.add(str(stage_id), WebServerHandler._agent.status.snapshot())
+
+    def _send_body(self, status, body, content_type='text/plain'):
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body_chunks(self):
+        """ Yield the request body piece by piece, sent with a Content-Length or chunked transfer encoding. """
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    # Skip the trailer section up to the final empty line
+                    while self.rfile.readline().strip():
+                        pass
+                    return
+                yield self.rfile.read(size)
+                self.rfile.readline()
+        else:
+            remaining = int(self.headers.get('Content-Length', 0))
+            while remaining > 0:
+                chunk = self.rfile.read(min(remaining, 65536))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+
+    def _read_body(self):
+        """ :return: the whole request body, None after answering a malformed one with 400 """
+        try:
+            return b''.join(self._body_chunks())
+        except ValueError as err:
+            # Where the body ends is unknown, so the rest of the connection can not be read as requests
+            self.close_connection = True
+            self._send_body(400, "Invalid request body: %s\n" % err)
+            return None
+
+    def _body_lines(self):
+        pending = b''
+        for chunk in self._body_chunks():
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                if line.strip():
+                    yield line
+        if pending.strip():
+            yield pending
+
+    def _schedule(self, path, event):
+        """ :return: id of the scheduled event """
+        scheduled_time = int(event['timestamp']) / 1000.0
+        return WebServerHandler._agent.scheduler.enterabs(scheduled_time, run_event,
+                                                          (path, WebServerHandler._agent, event),
+                                                          info={'path': path, 'stage': event['id']})
+
+    def _schedule_stream(self):
+        """
+        Schedule NDJSON events while they are uploaded, one event per line. On /events every line names its
+        target as "path", e.g. {"path": "/interface", "id": 1, "timestamp": ..., "data": {...}}.
+        """
+        event_ids = array('q')
+        line_number = 0
+        try:
+            for line_number, line in enumerate(self._body_lines(), start=1):
+                event = json.loads(line.decode('utf-8'))
+                path = event['path'] if self.path == '/events' else self.path
+                if path not in ('/application', '/interface'):
+                    raise ValueError("unknown path %r" % path)
+                event_ids.append(self._schedule(path, event))
+        except (ValueError, KeyError, TypeError) as err:
+            # The rest of the upload is not read, so this connection can not be reused
+            self.close_connection = True
+            self._send_body(400, dumps({"error": "Invalid event on line %d: %s" % (line_number, err),
+                                        "scheduled": event_ids.tolist()}), 'application/json')
+            return
+        self._send_body(200, dumps(event_ids.tolist()), 'application/json')
 
     def do_POST(self):
-        if len(WebServerHandler._stage_report) == 0:
-            print("Set stage 0 report")
-            WebServerHandler._stage_report["0"] = WebServerHandler._agent.status.to_json()
-        self.send_response(200)
-        content_length = int(self.headers['Content-Length'])
-        content_type = self.headers['Content-Type']
+        WebServerHandler._agent.reports.initialize("0", WebServerHandler._agent.status.snapshot())
+
+        content_type = (self.headers['Content-Type'] or '').split(';')[0].strip()
+        if content_type == 'application/x-ndjson':
+            self._schedule_stream()
+            return
+
+        # Always consume the body, otherwise it would be read as the next request on this connection
+        body = self._read_body()
+        if body is None:
+            return
 
         if content_type != 'application/json':
             print("Wrong content type,json expected!")
+            self._send_body(415, "Wrong content type, json or ndjson expected\n")
+            return
+        if self.path == '/events':
+            self._send_body(415, "Uploads to /events must be ndjson\n")
             return
 
-        body = self.rfile.read(content_length)
-        response = BytesIO()
-        response.write(b'Received: ' + body + b'\n')
-        self.end_headers()
+        try:
+            content_json_array = json.loads(body.decode('utf-8'))
+        except ValueError as err:
+            self._send_body(400, "Invalid json: %s\n" % err)
+            return
 
-        content_string = body.decode('utf-8')
-        content_json_array = json.loads(content_string)
+        if not isinstance(content_json_array, list):
+            self._send_body(400, "Invalid json: array of events expected\n")
+            return
 
-        scheduler = sched.scheduler(time.time, time.sleep)
+        event_ids = []
+        for index, event in enumerate(content_json_array):
+            try:
+                event_ids.append(self._schedule(self.path, event))
+            except (ValueError, KeyError, TypeError) as err:
+                self._send_body(400, dumps({"error": "Invalid event at index %d: %s" % (index, err),
+                                            "scheduled": event_ids}), 'application/json')
+                return
+        self._send_body(200, dumps(event_ids), 'application/json')
+
+    def do_PUT(self):
+        """ Reschedule a pending event, the body is {"timestamp": <ms>} """
+        body = self._read_body()
+        if body is None:
+            return
 
-        for event in content_json_array:
-            stage_id = event['id']
-            scheduled_time = int(event['timestamp']) / 1000.0
-            scheduler.enterabs(scheduled_time, 0, lambda: do_action(self.path, WebServerHandler._agent, event))
-            scheduler.enterabs(scheduled_time + 1, 0, lambda :self._update_report(stage_id))
+        match = re.match(r'/events/(\d+)$', self.path)
+        if not match:
+            self._send_body(404, "Not found\n")
+            return
+        try:
+            scheduled_time = int(json.loads(body.decode('utf-8'))['timestamp']) / 1000.0
+        except (ValueError, KeyError, TypeError) as err:
+            self._send_body(400, "Invalid event: %s\n" % err)
+            return
 
+        if WebServerHandler._agent.scheduler.reschedule(int(match.group(1)), scheduled_time):
+            self._send_body(200, "Rescheduled\n")
+        else:
+            self._send_body(404, "No pending event %s\n" % match.group(1))
 
-        threading.Thread(target=scheduler.run).start()
+    def do_DELETE(self):
+        match = re.match(r'/events/(\d+)$', self.path)
+        if match and WebServerHandler._agent.scheduler.cancel(int(match.group(1))):
+            self._send_body(200, "Cancelled\n")
+        else:
+            self._send_body(404, "Not found\n")
 
     def do_GET(self):
-        print(WebServerHandler._stage_report)
-        match = re.match(r'/reports/(.+)', self.path)
-        if match:
-            self.send_response(200)
-            self.end_headers()
-            stage_id = match.group(1)
-            self.wfile.write(WebServerHandler._stage_report[stage_id].encode())
+        if self.path == '/events':
+            self._send_body(200, dumps(WebServerHandler._agent.scheduler.pending()), 'application/json')
+            return
+        if self.path == '/metrics':
+            self._send_body(200, WebServerHandler._agent.metrics.to_prometheus(), 'text/plain; version=0.0.4')
+            return
+        if self.path == '/metrics/events':
+            self._send_body(200, dumps(WebServerHandler._agent.metrics.recent()), 'application/json')
+            return
+
+        url = urlsplit(self.path)
+        reports = WebServerHandler._agent.reports
+        if url.path == '/reports':
+            query = parse_qs(url.query)
+            if 'from' in query or 'to' in query:
+                try:
+                    first = float(query.get('from', ['-inf'])[0])
+                    last = float(query.get('to', ['inf'])[0])
+                except ValueError:
+                    self._send_body(400, "from and to must be numbers\n")
+                    return
+                self._send_body(200, reports.range(first, last), 'application/json')
+            else:
+                self._send_body(200, dumps(reports.stages()), 'application/json')
+            return
+
+        match = re.match(r'/reports/(.+)', url.path)
+        report = reports.get(match.group(1)) if match else None
+        if report is not None:
+            self._send_body(200, report, 'application/json')
         else:
-            self.send_error(404)
-            self.end_headers()
+            self._send_body(404, "Not found\n")
+
+
+class AgentServer(ThreadingHTTPServer):
+    """ Serves every connection on its own thread, so slow requests do not block other controllers. """
+    daemon_threads = True
+    request_queue_size = 128
 
 
-def do_action(path, agent, content_json_array):
-    content_dict = content_json_array['data']
+def run_event(path, agent, event):
+    """
+    Run a scheduled event and capture the stage report one second later. The report follows the event when it
+    has been rescheduled.
+    """
+    do_action(path, agent, event)
+    agent.scheduler.enter(1, WebServerHandler._update_report, (event['id'],),
+                          info={'path': path, 'stage': event['id'], 'report': True})
+
+
+def do_action(path, agent, event):
+    """
+    Queue the action of a scheduled event on the worker pool of its backend. Application changes are collected
+    and applied once all events of the same instant have been dispatched.
+    :return: future of the action, None for application changes
+    """
+    content_dict = event['data']
+    # Events run on the scheduler thread, which knows when they were planned for
+    current_event = agent.scheduler.current_event
+    planned = current_event.time if current_event is not None else time.monotonic()
 
     if path == "/application":
-        modify_application(agent, content_dict)
+        return modify_application(agent, content_dict, planned)
 
     if path == "/interface":
-        modify_interface(agent, content_dict)
+        return agent.tc_pool.submit(agent.metrics.timed, 'tc', content_dict.get('id'), planned,
+                                    modify_interface, agent, content_dict)
 
 
-def modify_application(agent, content_dict):
+def modify_application(agent, content_dict, planned):
     """
-    Apply modifications to specified application from scheduled event.
+    Queue modifications to specified application from scheduled event.
     :param agent:
     :param content_dict:
+    :param planned: monotonic time the event was scheduled for
     :return:
     """
-
-    if 'cpu' in content_dict:
-        agent.docker.update_cpu_shares(content_dict['name'], content_dict['cpu'])
-
-    if 'memory' in content_dict:
-        agent.docker.update_memory_limit(content_dict['name'], content_dict['memory'])
+    agent.docker_updates.add(content_dict['name'], planned, cpu_shares=content_dict.get('cpu'),
+                             mem_limit=content_dict.get('memory'))
 
 
 def modify_interface(agent, content_dict):
@@ -492,15 +1335,40 @@ def modify_interface(agent, content_dict):
     else:
         agent.tc.disable(content_dict['id'])
 
+
+def make_server(agent, port=20200, address=''):
+    WebServerHandler._agent = agent
+    return AgentServer((address, port), WebServerHandler)
+
+
 def main():
-    port = 20200
-    server = HTTPServer(('', port), WebServerHandler)
-    print("Web server is running on port {}".format(port))
+    parser = argparse.ArgumentParser(description='MockFog agent')
+    parser.add_argument('--port', type=int, default=20200, help='port to listen on (default: 20200)')
+    parser.add_argument('--docker-workers', type=int, default=4,
+                        help='number of concurrent Docker operations (default: 4)')
+    parser.add_argument('--tc-workers', type=int, default=1,
+                        help='number of concurrent tc operations (default: 1)')
+    parser.add_argument('--tc-poll-interval', type=float, default=0,
+                        help='seconds between interface status refreshes from tcshow, 0 disables polling (default: 0)')
+    parser.add_argument('--report-max-stages', type=int, default=ReportStore.DEFAULT_MAX_STAGES,
+                        help='number of stage reports kept in memory, 0 keeps all of them (default: %d)'
+                             % ReportStore.DEFAULT_MAX_STAGES)
+    parser.add_argument('--report-max-age', type=float, default=None,
+                        help='seconds a stage report is kept in memory (default: unlimited)')
+    parser.add_argument('--report-spill', default=None,
+                        help='append-only file that receives reports dropped from memory (default: drop them)')
+    args = parser.parse_args()
+
+    reports = ReportStore(args.report_max_stages or None, args.report_max_age, args.report_spill)
+    agent = Agent(docker_workers=args.docker_workers, tc_workers=args.tc_workers,
+                  tc_poll_interval=args.tc_poll_interval, reports=reports)
+    server = make_server(agent, args.port)
+    print("Web server is running on port {}".format(args.port))
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         print(" ^C entered, stopping web server....")
-        server.socket.close()
+        server.server_close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,418 @@
+#!/usr/bin/env python
+"""
+Drives the MockFog agents of a testbed from one process.
+
+Schedules are pushed to and stage reports collected from all agents concurrently with asyncio. Every agent keeps
+one HTTP/1.1 keep-alive connection, so fanning out to hundreds of agents takes about one round-trip time instead
+of one per agent.
+
+Usage:
+    python mockfog_controller.py push schedule.yml
+    python mockfog_controller.py reports <stage> [--output reports.json]
+    python mockfog_controller.py collect <first stage> <last stage> [--output reports.csv]
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import sys
+import time
+
+import yaml
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_TESTBED_DEFINITION = os.path.join(PROJECT_DIR, 'testbed', 'testbed_definition.yml')
+DEFAULT_MAPPING = os.path.join(PROJECT_DIR, 'mapping.yml')
+AGENT_PORT = 20200
+
+
+class AgentError(Exception):
+    pass
+
+
+class AgentUnreachable(AgentError):
+    """ The connection could not be opened, so the request was not sent. """
+    pass
+
+
+class AgentConnection(object):
+    """ Keep-alive HTTP/1.1 connection to one agent, requests on it are sent one after the other. """
+
+    def __init__(self, name, host, port=AGENT_PORT):
+        self.name = name
+        self.host = host
+        self.port = port
+        self._reader = None
+        self._writer = None
+        # Created on first use, asyncio primitives bind to the running loop before Python 3.10
+        self._lock = None
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def request(self, method, path, body=b'', content_type='application/json', connect_timeout=None):
+        """
+        Send a request, opening the connection first if needed.
+        :return: status code and response body
+        :raises AgentUnreachable: if the connection could not be opened within connect_timeout seconds
+        """
+        return (await self.pipeline([(method, path, body, content_type)], connect_timeout))[0]
+
+    async def pipeline(self, requests, connect_timeout=None):
+        """
+        Send several requests at once and then read their responses in order (HTTP/1.1 pipelining), so they
+        cost one round-trip time together.
+        :param requests: (method, path, body, content type) tuples
+        :return: status code and response body per request
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._writer is None:
+                try:
+                    self._reader, self._writer = await asyncio.wait_for(
+                        asyncio.open_connection(self.host, self.port), connect_timeout)
+                except (OSError, asyncio.TimeoutError) as err:
+                    raise AgentUnreachable('Cannot connect to {} ({}:{}): {!r}'.format(self.name, self.host,
+                                                                                       self.port, err))
+            try:
+                for method, path, body, content_type in requests:
+                    self._send(method, path, body, content_type)
+                await self._writer.drain()
+                return [await self._read_response() for _ in requests]
+            except BaseException:
+                # The state of the connection is unknown, e.g. after a timeout
+                self.close()
+                raise
+
+    def _send(self, method, path, body, content_type):
+        head = '{} {} HTTP/1.1\r\nHost: {}\r\nContent-Length: {}\r\n'.format(method, path, self.host, len(body))
+        if body:
+            head += 'Content-Type: {}\r\n'.format(content_type)
+        self._writer.write(head.encode() + b'\r\n' + body)
+
+    async def _read_response(self):
+        if self._reader is None:
+            raise ConnectionError('{} closed the connection'.format(self.name))
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionError('{} closed the connection'.format(self.name))
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+
+        if 'content-length' in headers:
+            response = await self._reader.readexactly(int(headers['content-length']))
+        else:
+            response = await self._reader.read()
+        if headers.get('connection', '').lower() == 'close' or 'content-length' not in headers:
+            self.close()
+        return status, response
+
+
+def load_agents(testbed_definition=DEFAULT_TESTBED_DEFINITION, mapping=DEFAULT_MAPPING, port=AGENT_PORT):
+    """
+    Pair the machines of the testbed definition with the public addresses from the mapping.
+    :param mapping: mapping.yml, either a list of {id, ip} or a dict name -> ip; an ip may carry its own :port
+    :return: AgentConnection per machine, ordered as in the testbed definition
+    """
+    with open(testbed_definition) as file:
+        nodes = yaml.safe_load(file)['nodes']
+    with open(mapping) as file:
+        addresses = yaml.safe_load(file)
+    if isinstance(addresses, list):
+        addresses = {item['id']: item['ip'] for item in addresses}
+
+    agents = []
+    for node in nodes:
+        address = addresses.get(node['name'])
+        if address is None:
+            logging.warning('%s: no address in %s, skipping', node['name'], mapping)
+            continue
+        host, _, agent_port = str(address).partition(':')
+        agents.append(AgentConnection(node['name'], host, int(agent_port) if agent_port else port))
+    return agents
+
+
+class Controller(object):
+    """ Runs one request per agent on all agents at once, with a timeout and retries per agent. """
+
+    def __init__(self, agents, timeout=5, retries=3, backoff=0.2, max_concurrency=1000):
+        """
+        :param agents: AgentConnection per agent
+        :param timeout: seconds for one request, including connecting
+        :param retries: further attempts after a failed one
+        :param backoff: seconds before the first retry, doubled for every further one
+        :param max_concurrency: requests in flight at the same time, bounded by the open file limit
+        """
+        self.agents = agents
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+
+    async def _request(self, agent, method, path, body=b'', content_type='application/json'):
+        """ :return: the response body """
+        return (await self._pipeline(agent, [(method, path, body, content_type)]))[0]
+
+    async def _pipeline(self, agent, requests):
+        """
+        Send requests pipelined on the connection of agent. Requests without side effects are retried after any
+        failure, others only when the agent could not be reached, so events are never scheduled twice because a
+        response was lost.
+        :param requests: (method, path, body, content type) tuples
+        :return: the response bodies
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        idempotent = all(request[0] in ('GET', 'PUT', 'DELETE') for request in requests)
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._semaphore:
+                    responses = await asyncio.wait_for(agent.pipeline(requests, connect_timeout=self.timeout),
+                                                       self.timeout * len(requests))
+            except AgentUnreachable as err:
+                error = err
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError) as err:
+                error = AgentError('{} failed on {}: {!r}'.format(agent.name, requests[0][1], err))
+                if not idempotent:
+                    raise error
+            else:
+                for (method, path, _, _), (status, response) in zip(requests, responses):
+                    if status >= 400:
+                        raise AgentError('{} answered {} {} with {}: {}'.format(
+                            agent.name, method, path, status, response.decode(errors='replace').strip()))
+                return [response for _, response in responses]
+            if attempt < self.retries:
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+        raise error
+
+    async def _fan_out(self, calls):
+        """
+        :param calls: agent -> coroutine
+        :return: agent name -> result or the exception it failed with
+        """
+        agents = list(calls)
+        results = await asyncio.gather(*calls.values(), return_exceptions=True)
+        return {agent.name: result for agent, result in zip(agents, results)}
+
+    async def push(self, schedule):
+        """
+        Upload the events of every agent in one request.
+        :param schedule: agent name -> list of events, each {"path": "/application" | "/interface", "id",
+            "timestamp", "data"}
+        :return: agent name -> list of scheduled event ids or exception
+        """
+        calls = {}
+        for agent in self.agents:
+            events = schedule.get(agent.name)
+            if events:
+                body = b''.join(json.dumps(event).encode() + b'\n' for event in events)
+                calls[agent] = self._request(agent, 'POST', '/events', body, 'application/x-ndjson')
+        results = await self._fan_out(calls)
+        return {name: json.loads(result) if isinstance(result, bytes) else result for name, result in results.items()}
+
+    async def reports(self, stage):
+        """ :return: agent name -> report of the stage or exception """
+        results = await self._fan_out({agent: self._request(agent, 'GET', '/reports/{}'.format(stage))
+                                       for agent in self.agents})
+        return {name: json.loads(result) if isinstance(result, bytes) else result for name, result in results.items()}
+
+    async def collect(self, first, last, window=500):
+        """
+        Fetch the reports of stages first to last (numeric, inclusive) from all agents into one table. Every
+        agent is asked for windows of stages with the bulk range endpoint, all windows pipelined on its connection.
+        :return: ReportTable and agent name -> exception for the agents that failed
+        """
+        windows = [(start, min(start + window - 1, last)) for start in range(first, last + 1, window)]
+        requests = [('GET', '/reports?from={}&to={}'.format(start, end), b'', None) for start, end in windows]
+        results = await self._fan_out({agent: self._pipeline(agent, requests) for agent in self.agents})
+
+        table = ReportTable()
+        failures = {}
+        for name, result in results.items():
+            if isinstance(result, Exception):
+                failures[name] = result
+                continue
+            for response in result:
+                for stage, report in json.loads(response).items():
+                    table.add_report(name, stage, report)
+        return table, failures
+
+    def close(self):
+        for agent in self.agents:
+            agent.close()
+
+
+class ReportTable(object):
+    """
+    Report values in columnar form, one row per node, stage, component and metric. Components are the containers
+    (kind "container") and the network interface (kind "interface") of a node.
+    """
+
+    COLUMNS = ('node', 'stage', 'kind', 'component', 'metric', 'value')
+
+    def __init__(self):
+        self.columns = {column: [] for column in self.COLUMNS}
+
+    def __len__(self):
+        return len(self.columns['node'])
+
+    def _append(self, *row):
+        for column, value in zip(self.COLUMNS, row):
+            self.columns[column].append(value)
+
+    def add_report(self, node, stage, report):
+        for container, values in report.get('containers', {}).items():
+            for metric, value in values.items():
+                self._append(node, stage, 'container', container, metric, value)
+        interface = report.get('interface', {})
+        for metric, value in interface.items():
+            if metric != 'id':
+                self._append(node, stage, 'interface', interface.get('id'), metric, value)
+
+    def to_csv(self, path):
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(self.COLUMNS)
+            writer.writerows(zip(*(self.columns[column] for column in self.COLUMNS)))
+
+    def to_parquet(self, path):
+        """ Requires pyarrow. """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError('Writing Parquet requires pyarrow (pip install pyarrow), use a .csv output instead')
+        pyarrow.parquet.write_table(pyarrow.table(self.columns), path)
+
+    def dump(self, path):
+        """ Write the table as Parquet or CSV, depending on the file extension. """
+        if path.endswith('.parquet'):
+            self.to_parquet(path)
+        else:
+            self.to_csv(path)
+
+
+def build_schedule(definition, agents, start=None):
+    """
+    Expand a schedule definition into the events of every agent.
+
+    The definition lists stages, each with an offset in seconds from the start and the changes of that stage:
+
+        - stage: 1
+          offset: 10
+          application: {<node name or '*'>: {name: application, cpu: 512, memory: 128m}}
+          interface: {<node name or '*'>: {id: eth0, delay: 10ms, active: true}}
+
+    :param start: wall-clock time of offset 0, defaults to now
+    :return: agent name -> events
+    """
+    start = time.time() if start is None else start
+    schedule = {agent.name: [] for agent in agents}
+    for stage in definition:
+        timestamp = int((start + stage.get('offset', 0)) * 1000)
+        for kind in ('application', 'interface'):
+            changes = stage.get(kind) or {}
+            for agent in agents:
+                data = changes.get(agent.name, changes.get('*'))
+                if data is not None:
+                    schedule[agent.name].append({'path': '/' + kind, 'id': stage['stage'], 'timestamp': timestamp,
+                                                 'data': data})
+    return schedule
+
+
+def _print_failures(results):
+    failures = {name: result for name, result in results.items() if isinstance(result, Exception)}
+    for name, error in sorted(failures.items()):
+        print('{}: {}'.format(name, error), file=sys.stderr)
+    return failures
+
+
+async def _push(controller, definition):
+    schedule = build_schedule(definition, controller.agents)
+    start = time.perf_counter()
+    results = await controller.push(schedule)
+    failures = _print_failures(results)
+    print('Pushed {} events to {} agents in {:.0f}ms, {} failed'.format(
+        sum(map(len, schedule.values())), len(results), (time.perf_counter() - start) * 1e3, len(failures)))
+    return 1 if failures else 0
+
+
+async def _collect(controller, first, last, output):
+    start = time.perf_counter()
+    table, failures = await controller.collect(first, last)
+    _print_failures(failures)
+    table.dump(output)
+    print('Collected {} values from {} agents in {:.0f}ms, {} failed'.format(
+        len(table), len(controller.agents) - len(failures), (time.perf_counter() - start) * 1e3, len(failures)))
+    return 1 if failures else 0
+
+
+async def _reports(controller, stage, output):
+    start = time.perf_counter()
+    results = await controller.reports(stage)
+    failures = _print_failures(results)
+    reports = {name: result for name, result in results.items() if name not in failures}
+    print('Collected {} reports in {:.0f}ms, {} failed'.format(len(reports), (time.perf_counter() - start) * 1e3,
+                                                               len(failures)), file=sys.stderr)
+    if output:
+        with open(output, 'w') as file:
+            json.dump(reports, file, indent=2)
+    else:
+        json.dump(reports, sys.stdout, indent=2)
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Push schedules to and collect reports from all MockFog agents')
+    parser.add_argument('--testbed-definition', default=DEFAULT_TESTBED_DEFINITION,
+                        help='testbed definition listing the nodes (default: testbed/testbed_definition.yml)')
+    parser.add_argument('--mapping', default=DEFAULT_MAPPING,
+                        help='node name to public ip mapping written by make info (default: mapping.yml)')
+    parser.add_argument('--port', type=int, default=AGENT_PORT, help='agent port (default: 20200)')
+    parser.add_argument('--timeout', type=float, default=5, help='seconds per request (default: 5)')
+    parser.add_argument('--retries', type=int, default=3, help='retries per agent (default: 3)')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    push = subparsers.add_parser('push', help='schedule the stages of a schedule file on all agents')
+    push.add_argument('schedule', help='YAML or JSON schedule definition')
+    reports = subparsers.add_parser('reports', help='collect the report of a stage from all agents')
+    reports.add_argument('stage')
+    reports.add_argument('--output', help='file to write the reports to (default: stdout)')
+    collect = subparsers.add_parser('collect', help='collect a range of stages from all agents into one table')
+    collect.add_argument('first', type=int, help='first stage')
+    collect.add_argument('last', type=int, help='last stage')
+    collect.add_argument('--output', default='reports.csv', help='.csv or .parquet file (default: reports.csv)')
+    args = parser.parse_args()
+
+    agents = load_agents(args.testbed_definition, args.mapping, args.port)
+
+    async def run():
+        controller = Controller(agents, timeout=args.timeout, retries=args.retries)
+        try:
+            if args.command == 'push':
+                with open(args.schedule) as file:
+                    return await _push(controller, yaml.safe_load(file))
+            if args.command == 'collect':
+                return await _collect(controller, args.first, args.last, args.output)
+            return await _reports(controller, args.stage, args.output)
+        finally:
+            controller.close()
+
+    sys.exit(asyncio.run(run()))
+
+
+if __name__ == '__main__':
+    main()
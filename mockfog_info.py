@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Writes the node name to public IP mapping of the running testbed.
+
+The mapping is taken from the EC2 inventory printed by inventory/ec2.py --list. ec2.py picks the cache file of
+its own configuration (ec2.ini, credentials, boto profile) and copies it out while it is still fresh, otherwise it
+queries the EC2 API once per region and refreshes the cache. Both mapping files are replaced atomically, readers never
+see a partially written file.
+
+Usage: python mockfog_info.py [--inventory inventory.json]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import yaml
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+EC2_SCRIPT = os.path.join(PROJECT_DIR, 'inventory', 'ec2.py')
+MAPPING = os.path.join(PROJECT_DIR, 'mapping.yml')
+APPLICATION_MAPPING = os.path.join(PROJECT_DIR, 'mockfog_application', 'vars', 'mapping.yml')
+# inventory group of all MockFog machines, see ec2.py
+NODES_GROUP = 'all_nodes'
+
+
+def load_inventory(path=None):
+    """
+    :param path: inventory JSON as printed by ec2.py --list, None runs ec2.py --list, which serves its own cache
+        while that is fresh
+    :return: the inventory
+    """
+    if path is not None:
+        with open(path) as file:
+            return json.load(file)
+    result = subprocess.run([sys.executable, EC2_SCRIPT, '--list'], cwd=PROJECT_DIR, stdout=subprocess.PIPE,
+                            check=True, universal_newlines=True)
+    return json.loads(result.stdout)
+
+
+def build_mapping(inventory):
+    """ :return: node name -> public IP of all MockFog machines, ordered by name """
+    hostvars = inventory.get('_meta', {}).get('hostvars', {})
+    mapping = {}
+    for host in inventory.get(NODES_GROUP, []):
+        attributes = hostvars.get(host, {})
+        name = attributes.get('ec2_tag_Name', host)
+        address = attributes.get('ec2_ip_address')
+        if address:
+            mapping[name] = address
+        else:
+            print('{}: no public IP, skipping'.format(name), file=sys.stderr)
+    return dict(sorted(mapping.items()))
+
+
+def write_atomically(path, content):
+    directory = os.path.dirname(path)
+    handle, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path))
+    try:
+        with os.fdopen(handle, 'w') as file:
+            file.write(content)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def write_mapping(mapping, mapping_path=MAPPING, application_mapping_path=APPLICATION_MAPPING):
+    """ Writes the mapping as list of {id, ip} and, for mockfog_application, as dict name -> ip. """
+    entries = [{'id': name, 'ip': address} for name, address in mapping.items()]
+    write_atomically(mapping_path, yaml.safe_dump(entries, default_flow_style=False))
+    write_atomically(application_mapping_path, yaml.safe_dump(mapping, default_flow_style=False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write the node name to public IP mapping of the testbed')
+    parser.add_argument('--inventory', default=None,
+                        help='inventory JSON to read instead of the ec2.py cache, e.g. the output of ec2.py --list')
+    args = parser.parse_args()
+
+    mapping = build_mapping(load_inventory(args.inventory))
+    write_mapping(mapping)
+    print('Wrote the addresses of {} nodes to {} and {}'.format(
+        len(mapping), os.path.relpath(MAPPING, PROJECT_DIR), os.path.relpath(APPLICATION_MAPPING, PROJECT_DIR)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Compares applying a node's tc rule set with one tc process per rule against a single tc -batch process.
+
+The rule sets are built by filter_plugins/tc_rules.py and applied to a veth interface in a scratch network
+namespace, so this requires root. Use --leaf pfifo on kernels without sch_netem.
+
+Usage: sudo python benchmark_tc_batch.py [--sizes 10 100 500] [--repeat 3]
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'filter_plugins'))
+
+from benchmark_tc_rules import INTERFACE, NAMESPACE, setup_namespace, synthetic_config, teardown_namespace  # noqa: E402
+from tc_rules import tc_rules  # noqa: E402
+
+
+def reset():
+    subprocess.run(['ip', 'netns', 'exec', NAMESPACE, 'tc', 'qdisc', 'delete', 'dev', INTERFACE, 'root'],
+                   stderr=subprocess.DEVNULL)
+
+
+def per_rule(rules):
+    for rule in rules:
+        subprocess.run(['ip', 'netns', 'exec', NAMESPACE, 'tc'] + rule.split(), check=True,
+                       stderr=subprocess.DEVNULL)
+
+
+def batch(rules):
+    subprocess.run(['ip', 'netns', 'exec', NAMESPACE, 'tc', '-batch', '-'], input='\n'.join(rules) + '\n',
+                   universal_newlines=True, check=True, stderr=subprocess.DEVNULL)
+
+
+def timed(apply, rules, repeat):
+    best = None
+    for _ in range(repeat):
+        reset()
+        start = time.perf_counter()
+        apply(rules)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark per-rule tc invocations against tc -batch')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500],
+                        help='Number of destinations (default: 10 100 500)')
+    parser.add_argument('--distinct-delays', type=int, default=5, help='Number of distinct delays (default: 5)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement, the best is reported')
+    parser.add_argument('--leaf', choices=['netem', 'pfifo'], default='netem',
+                        help='Leaf qdisc used for the measurement (default: netem)')
+    args = parser.parse_args()
+
+    setup_namespace()
+    try:
+        print('{:>6} {:>8} {:>16} {:>16} {:>8}'.format('dests', 'rules', 'per rule [ms]', 'tc -batch [ms]', 'speedup'))
+        for size in args.sizes:
+            rules = tc_rules(synthetic_config(size, args.distinct_delays), INTERFACE)
+            if args.leaf == 'pfifo':
+                rules = [re.sub(r'netem .*', 'pfifo', rule) for rule in rules]
+            forked = timed(per_rule, rules, args.repeat)
+            batched = timed(batch, rules, args.repeat)
+            print('{:>6} {:>8} {:>16.1f} {:>16.1f} {:>7.1f}x'.format(size, len(rules), forked * 1e3, batched * 1e3,
+                                                                     forked / batched))
+    finally:
+        teardown_namespace()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+Compares the hashed, grouped tc rule set of filter_plugins/tc_rules.py with the previous linear one.
+
+Rule counts are always reported. With --netns (requires root) both rule sets are applied to a veth interface in
+a scratch network namespace and the time to send packets to the destination matched last by the linear chain is
+measured. Use --leaf pfifo on kernels without sch_netem, classification cost does not depend on the leaf qdisc.
+
+Usage: sudo python benchmark_tc_rules.py --netns [--sizes 10 100 500] [--packets 20000]
+"""
+
+import argparse
+import ipaddress
+import os
+import random
+import re
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'filter_plugins'))
+
+from tc_rules import linear_tc_rules, tc_rules  # noqa: E402
+
+NAMESPACE = 'mockfog-bench'
+INTERFACE = 'mfb0'
+PEER = 'mfb1'
+PEER_MAC = '02:00:00:00:00:02'
+
+SEND_SCRIPT = '''
+import socket, sys, time
+sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+target, packets = sys.argv[1], int(sys.argv[2])
+start = time.perf_counter()
+for _ in range(packets):
+    sock.sendto(b'x', (target, 9))
+print(time.perf_counter() - start)
+'''
+
+
+def synthetic_config(destinations, distinct_delays, seed=0):
+    rng = random.Random(seed)
+    hosts = rng.sample(range(1, 2 ** 16 - 1), destinations)
+    delays = list(range(1, distinct_delays + 1))
+    return {
+        'bandwidth_out': 10000,
+        'delay_paths': [{
+            'target': 'node{}'.format(i),
+            'internal_ip': str(ipaddress.ip_address('10.0.0.0') + host),
+            'value': rng.choice(delays),
+        } for i, host in enumerate(hosts)],
+    }
+
+
+def count(rules, kind):
+    return sum(1 for rule in rules if rule.startswith(kind + ' '))
+
+
+def netns(*command, **kwargs):
+    return subprocess.run(['ip', 'netns', 'exec', NAMESPACE] + list(command), check=True,
+                          stdout=subprocess.PIPE, universal_newlines=True, **kwargs)
+
+
+def setup_namespace():
+    subprocess.run(['ip', 'netns', 'add', NAMESPACE], check=True)
+    netns('ip', 'link', 'add', INTERFACE, 'type', 'veth', 'peer', 'name', PEER, 'address', PEER_MAC)
+    netns('ip', 'addr', 'add', '10.255.0.1/30', 'dev', INTERFACE)
+    netns('ip', 'addr', 'add', '10.255.0.2/30', 'dev', PEER)
+    netns('ip', 'link', 'set', INTERFACE, 'up')
+    netns('ip', 'link', 'set', PEER, 'up')
+    # Both veth ends live in the same namespace, so ARP would not resolve; use a static neighbor instead
+    netns('ip', 'neigh', 'add', '10.255.0.2', 'lladdr', PEER_MAC, 'dev', INTERFACE, 'nud', 'permanent')
+    netns('ip', 'route', 'add', '10.0.0.0/16', 'via', '10.255.0.2', 'dev', INTERFACE)
+
+
+def teardown_namespace():
+    subprocess.run(['ip', 'netns', 'delete', NAMESPACE])
+
+
+def measure(rules, target, packets, leaf):
+    subprocess.run(['ip', 'netns', 'exec', NAMESPACE, 'tc', 'qdisc', 'delete', 'dev', INTERFACE, 'root'],
+                   stderr=subprocess.DEVNULL)
+    batch = '\n'.join(re.sub(r'netem .*', 'pfifo', rule) if leaf == 'pfifo' else rule for rule in rules)
+    netns('tc', '-batch', '-', input=batch + '\n', stderr=subprocess.DEVNULL)
+    # Warm up caches before timing
+    netns(sys.executable, '-c', SEND_SCRIPT, target, '100')
+    return float(netns(sys.executable, '-c', SEND_SCRIPT, target, str(packets)).stdout) / packets
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark tc rule generation')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500],
+                        help='Number of destinations (default: 10 100 500)')
+    parser.add_argument('--distinct-delays', type=int, default=5, help='Number of distinct delays (default: 5)')
+    parser.add_argument('--packets', type=int, default=20000, help='Packets sent per measurement (default: 20000)')
+    parser.add_argument('--netns', action='store_true', help='Measure classification cost in a network namespace')
+    parser.add_argument('--leaf', choices=['netem', 'pfifo'], default='netem',
+                        help='Leaf qdisc used for the measurement (default: netem)')
+    args = parser.parse_args()
+
+    if args.netns:
+        setup_namespace()
+    try:
+        print('{:>6} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8} {:>12} {:>12}'.format(
+            'dests', 'rules', 'filters', 'qdiscs', 'rules', 'filters', 'qdiscs', 'linear [us]', 'hashed [us]'))
+        print('{:>6} {:>26} {:>26}'.format('', 'linear', 'hashed'))
+        for size in args.sizes:
+            config = synthetic_config(size, args.distinct_delays)
+            linear = linear_tc_rules(config, INTERFACE)
+            hashed = tc_rules(config, INTERFACE)
+
+            linear_cost = hashed_cost = '-'
+            if args.netns:
+                target = config['delay_paths'][-1]['internal_ip']
+                linear_cost = '{:.2f}'.format(measure(linear, target, args.packets, args.leaf) * 1e6)
+                hashed_cost = '{:.2f}'.format(measure(hashed, target, args.packets, args.leaf) * 1e6)
+
+            print('{:>6} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8} {:>12} {:>12}'.format(
+                size, len(linear), count(linear, 'filter'), count(linear, 'qdisc'),
+                len(hashed), count(hashed, 'filter'), count(hashed, 'qdisc'), linear_cost, hashed_cost))
+    finally:
+        if args.netns:
+            teardown_namespace()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Builds the tc rule set that emulates the delays of a node's delay_paths.
+
+Besides the delay, a delay path may carry the jitter and loss of the path and its rate, the bottleneck bandwidth
+when it is below bandwidth_out (see testbed/link_model.py). Destinations with the same delay, jitter, loss and rate
+share one htb class and netem qdisc, so the number of qdiscs scales with the number of distinct paths. Destinations
+are classified by a u32 hash table keyed on the last octet of the destination address, so a packet only walks the
+(usually single-entry) chain of its bucket instead of one filter per destination.
+
+Nodes of a compact testbed definition (generate_testbed_definition.py --delay-matrix) carry their machine_id and the
+paths of the .npy matrices instead of delay_paths. Their delay paths are built from the host's rows of the
+memory-mapped matrices, which gives the same rules as the full definition.
+
+Used as an Ansible filter by configure_network.sh.j2, which applies all rules with a single tc process:
+
+    tc -batch - <<'TC_RULES'
+    {% for rule in testbed_config | tc_rules(network_interface) %}
+    {{ rule }}
+    {% endfor %}
+    TC_RULES
+"""
+
+import ipaddress
+from collections import OrderedDict
+
+# u32 handle of the destination hash table, 800: is the root table created by the kernel
+HASH_TABLE = 2
+# class and qdisc minors for the delay groups start here, 1:1 is the root class
+FIRST_GROUP = 0x10
+
+
+def delay_groups(delay_paths):
+    """
+    Groups delay paths by (delay, jitter, loss, rate), keeping the order in which the groups first appear.
+    Properties that a path does not set are 0, the rate is None then.
+    """
+    groups = OrderedDict()
+    for delay_path in delay_paths:
+        link = (delay_path['value'], delay_path.get('jitter', 0), delay_path.get('loss', 0), delay_path.get('rate'))
+        groups.setdefault(link, []).append(delay_path)
+    return groups
+
+
+def _netem(delay, jitter, loss):
+    netem = 'netem delay {}ms'.format(delay)
+    if jitter:
+        netem += ' {}ms'.format(jitter)
+    if loss:
+        netem += ' loss {}%'.format(loss)
+    return netem
+
+
+def sidecar_delay_paths(testbed_config):
+    """ Builds the delay_paths of a node of a compact testbed definition, see testbed/definition_writer.py. """
+    # Only compact definitions need numpy
+    import numpy as np
+
+    machine_id = testbed_config['machine_id']
+    rows = {}
+    for name in ('delay', 'jitter', 'loss', 'bandwidth'):
+        if testbed_config.get(name + '_matrix'):
+            rows[name] = np.load(testbed_config[name + '_matrix'], mmap_mode='r')[machine_id].tolist()
+    internal_ips = np.load(testbed_config['internal_ips'], mmap_mode='r').tolist()
+
+    delay_paths = []
+    for dst_id, internal_ip in enumerate(internal_ips):
+        if dst_id == machine_id:
+            continue
+        delay_path = {'internal_ip': str(ipaddress.IPv4Address(internal_ip)), 'value': rows['delay'][dst_id]}
+        for name in ('jitter', 'loss'):
+            if name in rows and rows[name][dst_id] > 0:
+                delay_path[name] = rows[name][dst_id]
+        if 'bandwidth' in rows and rows['bandwidth'][dst_id] < testbed_config['bandwidth_out']:
+            rate = rows['bandwidth'][dst_id]
+            delay_path['rate'] = int(rate) if float(rate).is_integer() else rate
+        delay_paths.append(delay_path)
+    return delay_paths
+
+
+def _delay_paths(testbed_config):
+    if 'delay_paths' not in testbed_config and testbed_config.get('delay_matrix'):
+        return sidecar_delay_paths(testbed_config)
+    return testbed_config.get('delay_paths', [])
+
+
+def _last_octet(internal_ip):
+    return int(internal_ip.rsplit('.', 1)[1])
+
+
+def tc_rules(testbed_config, interface):
+    """
+    Returns the tc commands (without the leading 'tc') that configure interface for testbed_config.
+    :param testbed_config: node of testbed_definition.yml, needs bandwidth_out and delay_paths or machine_id and the
+        matrix paths of a compact definition
+    :param interface: network interface to configure, e.g. eth1
+    """
+    bandwidth = testbed_config['bandwidth_out']
+    rules = [
+        'qdisc add dev {} root handle 1: htb'.format(interface),
+        'class add dev {} parent 1: classid 1:1 htb rate {}mbit'.format(interface, bandwidth),
+    ]
+
+    groups = delay_groups(_delay_paths(testbed_config))
+    for group_id, (delay, jitter, loss, rate) in enumerate(groups, start=FIRST_GROUP):
+        rules.append('class add dev {} parent 1:1 classid 1:{:x} htb rate {}mbit'.format(
+            interface, group_id, bandwidth if rate is None else rate))
+        rules.append('qdisc add dev {} parent 1:{:x} handle {:x}: {}'.format(interface, group_id, group_id,
+                                                                             _netem(delay, jitter, loss)))
+
+    if not groups:
+        return rules
+
+    # Hash every IPv4 packet on the last octet of its destination address (offset 16 in the IP header)
+    rules.append('filter add dev {} parent 1:0 prio 1 handle {}: protocol ip u32 divisor 256'.format(
+        interface, HASH_TABLE))
+    rules.append('filter add dev {} parent 1:0 prio 1 protocol ip u32 ht 800:: match ip dst 0.0.0.0/0 '
+                 'hashkey mask 0x000000ff at 16 link {}:'.format(interface, HASH_TABLE))
+
+    for group_id, delay_paths in enumerate(groups.values(), start=FIRST_GROUP):
+        for delay_path in delay_paths:
+            rules.append('filter add dev {} parent 1:0 prio 1 protocol ip u32 ht {}:{:x}: match ip dst {}/32 '
+                         'flowid 1:{:x}'.format(interface, HASH_TABLE, _last_octet(delay_path['internal_ip']),
+                                                delay_path['internal_ip'], group_id))
+    return rules
+
+
+def linear_tc_rules(testbed_config, interface):
+    """ Returns the previous rule set with one class, linear filter and netem qdisc per destination. """
+    bandwidth = testbed_config['bandwidth_out']
+    rules = [
+        'qdisc add dev {} root handle 1: htb'.format(interface),
+        'class add dev {} parent 1: classid 1:1 htb rate {}mbit'.format(interface, bandwidth),
+    ]
+    for index, delay_path in enumerate(_delay_paths(testbed_config), start=FIRST_GROUP):
+        rules.append('class add dev {} parent 1:1 classid 1:{:x} htb rate {}mbit'.format(interface, index,
+                                                                                         bandwidth))
+        rules.append('filter add dev {} protocol ip parent 1:0 prio 1 u32 match ip dst {}/32 flowid 1:{:x}'.format(
+            interface, delay_path['internal_ip'], index))
+        rules.append('qdisc add dev {} parent 1:{:x} handle {:x}: netem delay {}ms'.format(interface, index, index,
+                                                                                           delay_path['value']))
+    return rules
+
+
+class FilterModule(object):
+
+    def filters(self):
+        return {
+            'tc_rules': tc_rules,
+        }
@@ -0,0 +1,116 @@
+"""
+Content-addressed cache of the files generate_testbed_definition.py writes.
+
+A generation run is keyed by everything its output depends on: the topology definition, the generator options
+including the seed, and the source of the generator itself. A later run with the same key gets the stored files
+back instead of generating again, including the IP addresses that were drawn at random. Restoring leaves files
+that already have the stored content untouched, so their timestamps and everything derived from them (e.g. the
+tc script that mockfog_network templates from testbed_definition.yml) stay the same.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+# Output depends on these modules, a change to any of them invalidates all entries
+GENERATOR_SOURCES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py')
+MANIFEST = 'manifest.json'
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def generator_version():
+    """ Digest of the generator source, i.e. the version of the code that produced an entry. """
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(GENERATOR_SOURCES)):
+        digest.update(os.path.basename(path).encode())
+        digest.update(file_digest(path).encode())
+    return digest.hexdigest()
+
+
+def cache_key(options, input_paths=()):
+    """
+    :param options: JSON serializable generator options, e.g. the parsed command line
+    :param input_paths: files the output depends on, e.g. topology_definition.yml
+    :return: hex key of this generation run
+    """
+    inputs = {
+        'generator': generator_version(),
+        'options': options,
+        'inputs': {os.path.basename(path): file_digest(path) for path in input_paths},
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def _copy_atomically(src, dst):
+    handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(dst)), prefix='.' + os.path.basename(dst))
+    os.close(handle)
+    try:
+        shutil.copyfile(src, tmp_path)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, dst)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class ArtifactCache(object):
+    """
+    One directory per key holding the generated files, named by their digest, and a manifest that maps their paths
+    relative to the output directory to these digests.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def restore(self, key, output_dir):
+        """
+        Copies the files of key to output_dir, skipping the ones that are already up to date.
+        :return: paths of the restored files, None if key is not cached
+        """
+        try:
+            with open(os.path.join(self._entry(key), MANIFEST)) as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            return None
+
+        paths = []
+        for name, digest in manifest.items():
+            path = os.path.join(output_dir, name)
+            if not os.path.isfile(path) or file_digest(path) != digest:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                _copy_atomically(os.path.join(self._entry(key), digest), path)
+            paths.append(path)
+        return paths
+
+    def store(self, key, paths, output_dir):
+        """ Stores the given files of output_dir under key, replacing an existing entry. """
+        entry = self._entry(key)
+        tmp_entry = tempfile.mkdtemp(dir=self.cache_dir, prefix='.' + key)
+        try:
+            manifest = {}
+            for path in paths:
+                digest = file_digest(path)
+                shutil.copyfile(path, os.path.join(tmp_entry, digest))
+                manifest[os.path.relpath(path, output_dir)] = digest
+            with open(os.path.join(tmp_entry, MANIFEST), 'w') as file:
+                json.dump(manifest, file, indent=2)
+            # A concurrent run finds either a complete entry or none at all
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(tmp_entry, entry)
+        except BaseException:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            raise
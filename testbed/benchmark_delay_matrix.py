@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Times delay path generation for synthetic tree topologies.
+
+Usage: python benchmark_delay_matrix.py [--sizes 100 1000 5000] [--legacy-limit 100]
+"""
+
+import argparse
+import time
+
+import networkx as nx
+
+from common import fill_node_attrs, get_path_delay_between_machines
+from delay_matrix import compute_delay_matrix
+from topologies import random_tree
+
+
+def synthetic_topology(machines, fan_out=10, seed=0):
+    """ Random tree of one zone and the given number of machines, each machine has at most fan_out children. """
+    g = nx.Graph()
+    random_tree(g, machines, fan_out=fan_out, seed=seed, cidrs=['10.0.0.0/8'])
+    return g
+
+
+def legacy_delays(g):
+    machine_nodes = [node for node, attrs in g.nodes(data=True) if attrs['type'] == 'machine']
+    for src in machine_nodes:
+        for dst in machine_nodes:
+            if src != dst:
+                get_path_delay_between_machines(g, src, dst)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark delay path generation')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000],
+                        help='Number of machines per topology (default: 100 1000 5000)')
+    parser.add_argument('--legacy-limit', type=int, default=100,
+                        help='Largest size the per-pair Dijkstra baseline is run for (default: 100)')
+    args = parser.parse_args()
+
+    print('{:>8} {:>14} {:>18} {:>18}'.format('machines', 'matrix [s]', 'fill_node_attrs [s]', 'per-pair [s]'))
+    for size in args.sizes:
+        matrix = timed(compute_delay_matrix, synthetic_topology(size))
+        fill = timed(fill_node_attrs, synthetic_topology(size))
+        legacy = timed(legacy_delays, synthetic_topology(size)) if size <= args.legacy_limit else None
+        print('{:>8} {:>14.3f} {:>18.3f} {:>18}'.format(size, matrix, fill,
+                                                         '-' if legacy is None else '{:.3f}'.format(legacy)))
+
+
+if __name__ == '__main__':
+    main()
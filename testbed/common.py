@@ -1,28 +1,52 @@
-import random
 import sys
 
 import networkx as nx
 from networkx import Graph, NetworkXNoCycle, NetworkXNoPath
 
-# .1, .2, .3, .255 are reserved by AWS and we keep .4 through .10 as static options
-ip_address_pool = ['10.0.2.' + str(i) for i in range(11, 255)]
+from delay_matrix import DelayMatrixCache, compute_delay_matrix, compute_delay_matrix_incremental
+from ip_allocator import AddressSpaceExhausted, IpAllocator
+from link_model import PathMatrix, compute_path_matrix
+
+# .0, .1, .2, .3, .255 are reserved by AWS and we keep .4 through .10 as static options
+DEFAULT_CIDRS = ['10.0.2.0/24']
+DEFAULT_STATIC_IPS = ['10.0.2.' + str(i) for i in range(4, 11)]
+
+ip_allocator = IpAllocator(DEFAULT_CIDRS, static=DEFAULT_STATIC_IPS)
 app_configs = {}
 
+
+def configure_ip_allocator(cidrs=None, seed=None, static=None):
+    """
+    Replaces the address pool used by node_attrs, e.g. with the 'Network' section of topology_definition.yml.
+    :param cidrs: internal subnets to allocate from
+    :param seed: seed for reproducible address assignment
+    :param static: addresses that are assigned by hand
+    """
+    global ip_allocator
+    if cidrs is None:
+        cidrs = DEFAULT_CIDRS
+        static = DEFAULT_STATIC_IPS if static is None else static
+    ip_allocator = IpAllocator(cidrs, seed=seed, static=static or ())
+
+
 def generate_random_ip():
-    if len(ip_address_pool) == 0:
+    try:
+        return ip_allocator.allocate()
+    except AddressSpaceExhausted:
         print('IP address space exhausted! Aborting...')
         sys.exit(1)
-    random_ip = random.choice(ip_address_pool)
-    ip_address_pool.remove(random_ip)
-    return random_ip
 
 
 def node_attrs(**kwargs):
+    if 'internal_ip' in kwargs:
+        ip_allocator.reserve(kwargs['internal_ip'])
+    else:
+        kwargs['internal_ip'] = generate_random_ip()
+
     attrs = {
         'type': 'machine',
         'flavor': 't3.nano',
         'bandwidth_out': 10000,
-        'internal_ip': generate_random_ip(),
         **kwargs,
     }
     assert 'type' in attrs
@@ -33,8 +57,12 @@ def node_attrs(**kwargs):
 
 
 def edge_attrs(**kwargs):
+    # delay and jitter in ms, loss in percent, bandwidth in mbit/s or None for no limit besides bandwidth_out
     attrs = {
         'delay': 0,
+        'jitter': 0,
+        'loss': 0,
+        'bandwidth': None,
         **kwargs,
     }
     assert 'delay' in attrs
@@ -78,21 +106,41 @@ def validate_graph(g: Graph):
         sys.exit(1)
 
 
-def fill_node_attrs(g: Graph):
-    # Add name and delay paths
+def build_delay_paths(machine_nodes, delays, src_id):
+    """
+    Returns the delay_paths of machine src_id, built from its row of the delay matrix. With a PathMatrix, entries
+    also carry jitter, loss and rate where the path differs from an ideal link.
+    """
+    row = delays.values[src_id].tolist()
+    delay_paths = [{'target': dst_node, 'internal_ip': dst_attrs['internal_ip'], 'value': row[dst_id]}
+                   for dst_id, (dst_node, dst_attrs) in enumerate(machine_nodes)]
+    if isinstance(delays, PathMatrix) and delays.has_links():
+        for delay_path, link in zip(delay_paths, delays.links(src_id, machine_nodes[src_id][1]['bandwidth_out'])):
+            delay_path.update(link)
+    del delay_paths[src_id]
+    return delay_paths
+
+
+def fill_node_attrs(g: Graph, delay_cache_dir=None, delay_paths=True):
+    """
+    Adds the name and, unless delay_paths is False, the delay_paths of every machine.
+    With delay_paths=False only the delay matrix is computed, writers build the lists one node at a time.
+    :return: PathMatrix of all machines in machine ID order
+    """
     machine_nodes = [(node, attrs) for node, attrs in g.nodes(data=True) if attrs['type'] == 'machine']
-    for node, attrs in machine_nodes:
-        attrs_update = {
-            'name': node,
-            'delay_paths': []
-        }
-        for dst_node, dst_attrs in filter(lambda n: n[0] != node, machine_nodes):
-            attrs_update['delay_paths'].append({
-                'target': dst_node,
-                'internal_ip': dst_attrs['internal_ip'],
-                'value': get_path_delay_between_machines(g, node, dst_node)
-            })
-        g.node[node].update(attrs_update)
+    machines = [node for node, _ in machine_nodes]
+    if delay_cache_dir:
+        # Incremental mode: only recompute the delays affected by changed edges since the last run
+        delays = compute_delay_matrix_incremental(g, DelayMatrixCache(delay_cache_dir), machines)
+    else:
+        delays = compute_delay_matrix(g, machines)
+    delays = compute_path_matrix(g, delays)
+    for src_id, (node, attrs) in enumerate(machine_nodes):
+        attrs_update = {'name': node}
+        if delay_paths:
+            attrs_update['delay_paths'] = build_delay_paths(machine_nodes, delays, src_id)
+        g.nodes[node].update(attrs_update)
+    return delays
 
 
 def resolve_names(g):
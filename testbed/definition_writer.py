@@ -0,0 +1,144 @@
+"""
+Writes testbed_definition.yml one machine at a time.
+
+The delay_paths of a machine are built from its row of the delay matrix right before the machine is emitted and
+dropped afterwards, so peak memory holds the matrix and a single node instead of N^2 delay path dicts. Node
+attributes are emitted with libyaml when PyYAML was built with it. Delay path entries only differ in their target,
+value and link properties (see link_model), so every target and every distinct property value is emitted once and
+the N^2 entries are joined from these pieces, which gives the same text as dumping the lists.
+
+With a sidecar, the matrix is stored as .npy next to the definition and machines carry their machine_id instead of
+delay_paths. The definition then lists all machines once, in machine ID order:
+
+    delay_matrix: testbed_delays.npy
+    machines:
+    - name: machine0
+      internal_ip: 10.0.2.17
+    nodes:
+    - ...
+      machine_id: 0
+
+Link properties that the topology sets are stored the same way, e.g. loss_matrix: testbed_delays_loss.npy, and the
+internal IPs of all machines as uint32 in machine ID order (internal_ips: testbed_delays_ips.npy). inventory/ec2.py
+passes machine_id and the absolute paths of these files on in testbed_config, and the tc_rules filter of
+mockfog_network reads the row of its host from the memory-mapped matrices, so the O(N^2) delay_paths never end up in
+the hostvars.
+"""
+
+import ipaddress
+import os
+
+import numpy as np
+import yaml
+
+from link_model import PathMatrix
+
+Dumper = getattr(yaml, 'CDumper', yaml.Dumper)
+
+
+def _dump(data, file):
+    yaml.dump(data, file, Dumper=Dumper, default_flow_style=False, sort_keys=False)
+
+
+class DelayPathEmitter(object):
+    """ Emits the delay_paths of any machine as text, indented for a node of the nodes list. """
+
+    def __init__(self, machine_nodes):
+        self.targets = [self._indent(yaml.dump([{'target': attrs['name'], 'internal_ip': attrs['internal_ip']}],
+                                               Dumper=Dumper, default_flow_style=False, sort_keys=False))
+                                        for _, attrs in machine_nodes]
+        self.bandwidths = [attrs['bandwidth_out'] for _, attrs in machine_nodes]
+        self.properties = {}
+
+    @staticmethod
+    def _indent(text):
+        return ''.join('  ' + line for line in text.splitlines(True))
+
+    def _property(self, key, value):
+        # 1 and 1.0 are equal dict keys but are emitted differently
+        cache_key = (key, type(value), value)
+        if cache_key not in self.properties:
+            line = yaml.dump({key: value}, Dumper=Dumper, default_flow_style=False)
+            self.properties[cache_key] = self._indent(self._indent(line))
+        return self.properties[cache_key]
+
+    def emit(self, file, delays, src_id):
+        if len(self.targets) < 2:
+            file.write('  delay_paths: []\n')
+            return
+        row = delays.values[src_id].tolist()
+        file.write('  delay_paths:\n')
+        if isinstance(delays, PathMatrix) and delays.has_links():
+            links = delays.links(src_id, self.bandwidths[src_id])
+            file.write(''.join(self.targets[dst_id] + self._property('value', value) +
+                               ''.join(self._property(key, link_value) for key, link_value in links[dst_id].items())
+                               for dst_id, value in enumerate(row) if dst_id != src_id))
+        else:
+            file.write(''.join(self.targets[dst_id] + self._property('value', value)
+                               for dst_id, value in enumerate(row) if dst_id != src_id))
+
+
+def save_delay_matrix(path, values):
+    # Write to a temporary file first so concurrent readers never map a partially written matrix
+    tmp_path = path + '.tmp.npy'
+    np.save(tmp_path, values)
+    os.replace(tmp_path, path)
+
+
+def save_path_matrices(delay_matrix_path, delays, directory, internal_ips=()):
+    """
+    Stores the delays and, of a PathMatrix, every link property the topology sets next to each other, e.g.
+    testbed_delays.npy and testbed_delays_loss.npy.
+    :param internal_ips: internal IPs of the machines in machine ID order, stored as testbed_delays_ips.npy
+    :return: definition key -> path relative to directory
+    """
+    stem = delay_matrix_path[:-len('.npy')] if delay_matrix_path.endswith('.npy') else delay_matrix_path
+    matrices = {'delay_matrix': (delay_matrix_path, delays.values)}
+    if internal_ips:
+        matrices['internal_ips'] = ('{}_ips.npy'.format(stem), np.array(
+            [int(ipaddress.IPv4Address(internal_ip)) for internal_ip in internal_ips], dtype=np.uint32))
+    if isinstance(delays, PathMatrix):
+        for name in ('jitter', 'loss', 'bandwidth'):
+            if getattr(delays, name) is not None:
+                matrices[name + '_matrix'] = ('{}_{}.npy'.format(stem, name), getattr(delays, name))
+    references = {}
+    for key, (path, values) in matrices.items():
+        save_delay_matrix(path, values)
+        references[key] = os.path.relpath(path, directory)
+    return references
+
+
+def write_testbed_definition(path, machine_nodes, delays, delay_matrix_path=None):
+    """
+    :param path: testbed_definition.yml to write
+    :param machine_nodes: (node, attrs) of all machines in machine ID order, attrs already carry the name
+    :param delays: DelayMatrix or PathMatrix of these machines
+    :param delay_matrix_path: .npy file to store the delays in instead of per node delay_paths, the definition
+        refers to it (and the link property matrices next to it) relative to its own directory
+    :return: paths of all files written
+    """
+    files = [path]
+    with open(path, 'w') as file:
+        file.write('---\n')
+        if delay_matrix_path:
+            directory = os.path.dirname(os.path.abspath(path))
+            header = save_path_matrices(delay_matrix_path, delays, directory,
+                                        [attrs['internal_ip'] for _, attrs in machine_nodes])
+            files.extend(os.path.join(directory, matrix_path) for matrix_path in header.values())
+            header['machines'] = [{'name': attrs['name'], 'internal_ip': attrs['internal_ip']}
+                                  for _, attrs in machine_nodes]
+            _dump(header, file)
+
+        if not machine_nodes:
+            file.write('nodes: []\n')
+            return files
+        file.write('nodes:\n')
+        delay_paths = None if delay_matrix_path else DelayPathEmitter(machine_nodes)
+        for src_id, (_, attrs) in enumerate(machine_nodes):
+            # A single item list emits an indentless sequence entry, exactly as dumping the whole list would
+            if delay_paths is None:
+                _dump([dict(attrs, machine_id=src_id)], file)
+            else:
+                _dump([attrs], file)
+                delay_paths.emit(file, delays, src_id)
+    return files
@@ -0,0 +1,281 @@
+import hashlib
+import json
+import os
+
+import networkx as nx
+import numpy as np
+from networkx import Graph, NetworkXNoPath
+
+
+class DelayMatrix(object):
+    """ Dense machine-to-machine delay matrix. Row and column i belong to machines[i] (the machine ID). """
+
+    def __init__(self, machines, values):
+        self.machines = list(machines)
+        self.index = {machine: machine_id for machine_id, machine in enumerate(self.machines)}
+        self.values = values
+
+    def __len__(self):
+        return len(self.machines)
+
+    def delay(self, src, dst):
+        return self.values[self.index[src], self.index[dst]].item()
+
+    def row(self, src):
+        return self.values[self.index[src]].tolist()
+
+
+def get_machine_nodes(g: Graph):
+    return [node for node, attrs in g.nodes(data=True) if attrs['type'] == 'machine']
+
+
+def _delay_dtype(g: Graph):
+    # Keep integer delays integral, the network template appends a unit suffix to the raw value
+    for _, _, delay in g.edges(data='delay', default=0):
+        if not isinstance(delay, (int, np.integer)):
+            return np.float64
+    return np.int64
+
+
+class TreeIndex(object):
+    """
+    Euler tour (preorder) index of a tree topology.
+
+    The tree is rooted at its first node and walked in preorder, so the machines below any node form a
+    contiguous range of preorder positions [lo, lo + size). Any machine-to-machine path crosses the edge between
+    a node and its parent exactly when one end lies inside that range and the other one outside of it.
+    """
+
+    def __init__(self, g: Graph, machines):
+        machine_ids = {machine: machine_id for machine_id, machine in enumerate(machines)}
+        self.root = next(iter(g.nodes))
+
+        # Iterative DFS, recursion would hit the interpreter limit on deep chains
+        self.preorder = []
+        self.parent = {self.root: None}
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            self.preorder.append(node)
+            for neighbor in g.adj[node]:
+                if neighbor != self.parent[node]:
+                    self.parent[neighbor] = node
+                    stack.append(neighbor)
+
+        # machine_order[position] is the machine ID found at that preorder position
+        self.position = {}
+        self.machine_order = []
+        self.lo = {}
+        for node in self.preorder:
+            self.lo[node] = len(self.machine_order)
+            if node in machine_ids:
+                self.position[node] = len(self.machine_order)
+                self.machine_order.append(machine_ids[node])
+
+        self.size = dict.fromkeys(self.preorder, 0)
+        for node in reversed(self.preorder):
+            if node in machine_ids:
+                self.size[node] += 1
+            if self.parent[node] is not None:
+                self.size[self.parent[node]] += self.size[node]
+
+    def child_of_edge(self, u, v):
+        """ Returns the endpoint of edge (u, v) that lies further away from the root. """
+        return v if self.parent[v] == u else u
+
+    def machines_below(self, node):
+        """ Returns the IDs of all machines in the subtree of node. """
+        return self.machine_order[self.lo[node]:self.lo[node] + self.size[node]]
+
+
+def _edge_delay(attrs):
+    return attrs.get('delay', 0)
+
+
+def _tree_delays(g: Graph, machines, dtype, tree=None, weight=_edge_delay):
+    """
+    Computes all machine-to-machine delays of a tree in O(N^2). Any other additive link property works the same way,
+    weight maps the attributes of an edge to its value.
+
+    Going from a parent p to its child c over an edge of delay w moves every machine w further away except for
+    the ones below c, which get w closer:
+
+        row(c) = row(p) + w,   row(c)[lo(c):lo(c) + size(c)] -= 2w
+
+    Columns are kept in preorder during the walk and are permuted to machine IDs at the end.
+    """
+    machine_ids = {machine: machine_id for machine_id, machine in enumerate(machines)}
+    tree = tree or TreeIndex(g, machines)
+    preorder, parent, lo, size = tree.preorder, tree.parent, tree.lo, tree.size
+    root = tree.root
+
+    depth = {root: 0}
+    for node in preorder[1:]:
+        depth[node] = depth[parent[node]] + weight(g.edges[parent[node], node])
+
+    values = np.empty((len(machines), len(machines)), dtype=dtype)
+    root_row = np.empty(len(machines), dtype=dtype)
+    for machine in machines:
+        root_row[tree.position[machine]] = depth[machine]
+
+    # Rows of zones are only needed until all of their children have been visited
+    zone_rows = {root: root_row}
+    pending_children = {node: 0 for node in preorder}
+    for node in preorder[1:]:
+        pending_children[parent[node]] += 1
+
+    if root in machine_ids:
+        values[machine_ids[root]] = root_row
+
+    for node in preorder[1:]:
+        p = parent[node]
+        parent_row = values[machine_ids[p]] if p in machine_ids else zone_rows[p]
+        delay = weight(g.edges[p, node])
+
+        row = values[machine_ids[node]] if node in machine_ids else np.empty(len(machines), dtype=dtype)
+        np.add(parent_row, delay, out=row)
+        row[lo[node]:lo[node] + size[node]] -= 2 * delay
+        if node not in machine_ids:
+            zone_rows[node] = row
+
+        pending_children[p] -= 1
+        if pending_children[p] == 0:
+            zone_rows.pop(p, None)
+
+    return values[:, [tree.position[machine] for machine in machines]]
+
+
+def _dijkstra_delays(g: Graph, machines, dtype):
+    """ Computes all machine-to-machine delays with one Dijkstra run per source machine. """
+    values = np.empty((len(machines), len(machines)), dtype=dtype)
+    for src_id, src in enumerate(machines):
+        lengths = nx.single_source_dijkstra_path_length(g, src, weight='delay')
+        for dst_id, dst in enumerate(machines):
+            if dst not in lengths:
+                raise NetworkXNoPath('Node {} not reachable from {}'.format(dst, src))
+            values[src_id, dst_id] = lengths[dst]
+    return values
+
+
+def compute_delay_matrix(g: Graph, machines=None):
+    """
+    Computes the delays between all pairs of machines in a single pass.
+
+    Trees (which validate_graph enforces) use a linear walk per machine, any other graph falls back to one
+    Dijkstra run per source machine.
+    :param g: topology graph, edges carry their delay in the 'delay' attribute
+    :param machines: machine nodes in machine ID order, defaults to all machine nodes in graph order
+    :return: DelayMatrix
+    """
+    if machines is None:
+        machines = get_machine_nodes(g)
+    dtype = _delay_dtype(g)
+
+    if len(machines) == 0:
+        values = np.empty((0, 0), dtype=dtype)
+    elif nx.is_tree(g):
+        values = _tree_delays(g, machines, dtype)
+    else:
+        values = _dijkstra_delays(g, machines, dtype)
+
+    return DelayMatrix(machines, values)
+
+
+def _canonical_edges(g: Graph):
+    return sorted((tuple(sorted((u, v), key=repr)) for u, v in g.edges), key=repr)
+
+
+def topology_hash(g: Graph, machines):
+    """ Hashes everything the layout of a delay matrix depends on, i.e. the topology without its edge delays. """
+    topology = {
+        'nodes': sorted([repr(node), attrs['type']] for node, attrs in g.nodes(data=True)),
+        'edges': [[repr(u), repr(v)] for u, v in _canonical_edges(g)],
+        'machines': [repr(machine) for machine in machines],
+    }
+    return hashlib.sha256(json.dumps(topology).encode()).hexdigest()
+
+
+def update_edge_delay(delays: DelayMatrix, tree: TreeIndex, u, v, difference):
+    """
+    Adds difference to the delay of every machine pair whose path crosses edge (u, v).
+
+    These are exactly the pairs with one machine below the edge and the other one above it, so only
+    k * (N - k) entries in each triangle of the matrix are touched for a subtree holding k machines.
+    """
+    below = np.zeros(len(delays), dtype=bool)
+    below[tree.machines_below(tree.child_of_edge(u, v))] = True
+    inside = np.flatnonzero(below)
+    outside = np.flatnonzero(~below)
+    delays.values[np.ix_(inside, outside)] += difference
+    delays.values[np.ix_(outside, inside)] += difference
+
+
+class DelayMatrixCache(object):
+    """ Keeps delay matrices on disk, keyed by topology_hash, along with the edge delays they were computed for. """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def load(self, key):
+        try:
+            with np.load(self._path(key), allow_pickle=False) as cached:
+                return cached['values'], cached['edge_delays']
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def store(self, key, delays: DelayMatrix, edge_delays):
+        # Write to a temporary file first so concurrent runs never read a partially written matrix
+        tmp_path = self._path(key) + '.tmp.npz'
+        np.savez(tmp_path, values=delays.values, edge_delays=edge_delays)
+        os.replace(tmp_path, self._path(key))
+
+
+def compute_delay_matrix_incremental(g: Graph, cache: DelayMatrixCache, machines=None):
+    """
+    Computes the delay matrix, reusing the one cached for the same topology if only edge delays changed.
+
+    For trees, each changed edge only updates the machine pairs whose path crosses it. If the changes touch
+    more entries than a full computation would, or the topology is not cached yet, everything is recomputed.
+    :param g: topology graph, edges carry their delay in the 'delay' attribute
+    :param cache: DelayMatrixCache holding the matrices of previous runs
+    :param machines: machine nodes in machine ID order, defaults to all machine nodes in graph order
+    :return: DelayMatrix
+    """
+    if machines is None:
+        machines = get_machine_nodes(g)
+    dtype = _delay_dtype(g)
+
+    key = topology_hash(g, machines)
+    edges = _canonical_edges(g)
+    edge_delays = np.array([g.edges[u, v].get('delay', 0) for u, v in edges], dtype=dtype)
+
+    cached = cache.load(key) if len(machines) > 0 and nx.is_tree(g) else None
+    delays = None
+    # Switching between integral and fractional delays changes the matrix dtype, recompute in that case
+    if cached is not None and cached[0].dtype == dtype:
+        values, cached_edge_delays = cached
+        delays = DelayMatrix(machines, values)
+        tree = TreeIndex(g, machines)
+
+        changed = np.flatnonzero(edge_delays != cached_edge_delays)
+        touched = 0
+        for edge_id in changed:
+            k = len(tree.machines_below(tree.child_of_edge(*edges[edge_id])))
+            touched += 2 * k * (len(machines) - k)
+
+        if touched <= len(machines) ** 2:
+            for edge_id in changed:
+                u, v = edges[edge_id]
+                update_edge_delay(delays, tree, u, v, edge_delays[edge_id] - cached_edge_delays[edge_id])
+        else:
+            delays = None
+
+    if delays is None:
+        delays = compute_delay_matrix(g, machines)
+
+    cache.store(key, delays, edge_delays)
+    return delays
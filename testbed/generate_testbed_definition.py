@@ -1,51 +1,110 @@
 #!/usr/bin/env python
 
+import argparse
+import os
 import sys
 
 import networkx as nx
 import yaml
-from matplotlib import pyplot as plt
 
 import generate_topologies
 import topologies
+from artifact_cache import ArtifactCache, cache_key
+from definition_writer import write_testbed_definition
 
 from common import (
+    configure_ip_allocator,
     fill_node_attrs,
     get_app_configurations,
     resolve_names,
     validate_graph
 )
 
+parser = argparse.ArgumentParser(description='Generate the testbed definition from topology_definition.yml')
+parser.add_argument('--delay-cache', action='store', default=None,
+                    help='Directory to keep delay matrices in, delays are then only recomputed for changed edges')
+parser.add_argument('--generator', choices=['definition', 'simple', 'fog', 'random'], default='definition',
+                    help='Source of the topology: topology_definition.yml (default), the 4 node example, '
+                         'a synthetic fog hierarchy or a random tree')
+parser.add_argument('--seed', type=int, default=None,
+                    help='Seed of the IP addresses and synthetic generators, the same seed gives the same testbed '
+                         '(Network.seed of topology_definition.yml takes precedence)')
+parser.add_argument('--fan-out', type=int, nargs='+', default=None,
+                    help='fog: children per machine of each tier, cloud first (default: 2 5 10 10)')
+parser.add_argument('--machines', type=int, default=1000, help='random: number of machines (default: 1000)')
+parser.add_argument('--delay-matrix', action='store', default=None, metavar='FILE',
+                    help='Store all delays in FILE (.npy) and refer to it instead of writing delay_paths per node, '
+                         'relative paths are relative to the testbed directory')
+parser.add_argument('--plot', action='store_true', default=False,
+                    help='Show the topology in a matplotlib window for a quick sanity check (default: headless)')
+parser.add_argument('--no-plot', action='store_false', dest='plot', help='Do not show the topology (default)')
+parser.add_argument('--dot', action='store', default=None, metavar='FILE',
+                    help='Write the topology as Graphviz DOT to FILE, render with e.g. dot -Tsvg')
+parser.add_argument('--cache', action='store', default=None, metavar='DIR',
+                    help='Keep generated files in DIR keyed by the topology definition, options and generator code, '
+                         'a run with the same key restores them instead of generating them again')
+args = parser.parse_args()
+
+# Reuse the files of an identical earlier run, plotting needs the graph and always generates
+
+cache = key = None
+if args.cache:
+    cache = ArtifactCache(args.cache)
+    options = {option: getattr(args, option) for option in ('generator', 'seed', 'fan_out', 'machines', 'delay_matrix')}
+    key = cache_key(options, [generate_topologies.TOPOLOGY_DEFINITION] if args.generator == 'definition' else [])
+    if not (args.plot or args.dot) and cache.restore(key, sys.path[0]) is not None:
+        print('Testbed definition unchanged, restored {} from {}'.format(key[:12], args.cache))
+        sys.exit(0)
+
 g = nx.Graph()
 
 # Generate topology
 
-generate_topologies.topology(g)
+if args.generator == 'definition':
+    generate_topologies.topology(g, seed=args.seed)
+elif args.generator == 'simple':
+    configure_ip_allocator(seed=args.seed)
+    topologies.simple_topology(g)
+elif args.generator == 'fog':
+    tiers = topologies.FOG_TIERS
+    if args.fan_out:
+        if len(args.fan_out) != len(tiers):
+            parser.error('--fan-out needs one value per tier ({})'.format(', '.join(t['role'] for t in tiers)))
+        tiers = [dict(tier, fan_out=fan_out) for tier, fan_out in zip(tiers, args.fan_out)]
+    topologies.fog_hierarchy(g, tiers, seed=args.seed)
+else:
+    topologies.random_tree(g, args.machines, seed=args.seed)
 
 # Process graph
 
 validate_graph(g)
 
-fill_node_attrs(g)
+delays = fill_node_attrs(g, delay_cache_dir=args.delay_cache, delay_paths=False)
 
 resolve_names(g)
 
 app_configs = get_app_configurations()
 
-# Build topology data
-
-topo = {
-    'nodes': [attrs for node, attrs in g.nodes(data=True) if attrs['type'] == 'machine']
-}
+# Write yaml file (path should match variable defined in defaults), delay_paths are built one node at a time
 
-# Write yaml file (path should match variable defined in defaults)
-with open(f'{sys.path[0]}/testbed_definition.yml', 'w') as file:
-    file.write(yaml.dump(topo, default_flow_style=False, sort_keys=False, explicit_start=True))
+machine_nodes = [(node, attrs) for node, attrs in g.nodes(data=True) if attrs['type'] == 'machine']
+written = write_testbed_definition(f'{sys.path[0]}/testbed_definition.yml', machine_nodes, delays,
+                                   delay_matrix_path=args.delay_matrix and os.path.join(sys.path[0], args.delay_matrix))
 
 # Write app_configs to yaml file (path should match variable defined in defaults)
 with open(f'{sys.path[0]}/application_definition.yml', 'w') as file:
     file.write(yaml.dump(app_configs, default_flow_style=False, sort_keys=False, explicit_start=True))
+written.append(f'{sys.path[0]}/application_definition.yml')
+
+if cache is not None:
+    cache.store(key, written, sys.path[0])
+
+# Render graph for a quick sanity check, plot_topology imports matplotlib only when plotting
+if args.dot or args.plot:
+    import plot_topology
+
+    if args.dot:
+        plot_topology.write_dot(g, args.dot)
+    if args.plot:
+        plot_topology.show(g)
 
-# Show graph for a quick sanity check
-nx.draw_networkx(g)
-plt.show()
@@ -2,13 +2,17 @@ import yaml
 
 from networkx.classes import Graph
 
-from common import node_attrs, edge_attrs, app_config
+from common import configure_ip_allocator, node_attrs, edge_attrs, app_config
 
-with open("topology_definition.yml", 'r') as stream:
-    try:
-        definitions = yaml.safe_load(stream)
-    except yaml.YAMLError as exc:
-        print(exc)
+TOPOLOGY_DEFINITION = 'topology_definition.yml'
+
+
+def load_definitions(path=TOPOLOGY_DEFINITION):
+    with open(path, 'r') as stream:
+        try:
+            return yaml.safe_load(stream)
+        except yaml.YAMLError as exc:
+            print(exc)
 
 
 def add_node(g: Graph, node):
@@ -20,14 +24,26 @@ def add_node(g: Graph, node):
     # the role is attached as tag to the AWS instance and can be used to run
     # tasks only on machines with a certain role (see mockfog_application.yml notebook)
     else:
-        g.add_node(node['name'], **node_attrs(role=node.get('role', None), flavor=node.get('flavor', None), image=node.get('image', None)))
+        attrs = {'role': node.get('role', None), 'flavor': node.get('flavor', None), 'image': node.get('image', None)}
+        if node.get('internal_ip'):
+            attrs['internal_ip'] = node['internal_ip']
+        g.add_node(node['name'], **node_attrs(**attrs))
 
 
 def add_edge(g: Graph, edge):
-    g.add_edge(edge['u_of_edge'], edge['v_of_edge'], **edge_attrs(delay=edge.get('delay', 0)))
-
-
-def topology(g: Graph):
+    # optional link model besides the delay, e.g. {jitter: 2, loss: 0.5, bandwidth: 100}
+    link = {key: edge[key] for key in ('jitter', 'loss', 'bandwidth') if edge.get(key) is not None}
+    g.add_edge(edge['u_of_edge'], edge['v_of_edge'], **edge_attrs(delay=edge.get('delay', 0), **link))
+
+
+def topology(g: Graph, path=TOPOLOGY_DEFINITION, seed=None):
+    """ :param seed: seed of the IP addresses unless the Network section sets one """
+    definitions = load_definitions(path)
+    # optional address pool configuration, e.g. {cidrs: [10.0.0.0/16], seed: 42, static: [10.0.0.10]}
+    network = dict(definitions.get('Network') or {})
+    if network.get('seed') is None:
+        network['seed'] = seed
+    configure_ip_allocator(**network)
     for node in definitions['Nodes']:
         add_node(g, node)
     for edge in definitions['Edges']:
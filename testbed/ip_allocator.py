@@ -0,0 +1,138 @@
+import bisect
+import ipaddress
+import random
+
+
+class AddressSpaceExhausted(Exception):
+    pass
+
+
+class IpAllocator(object):
+    """
+    Hands out random addresses from one or more subnets in O(1) per allocation.
+
+    All usable addresses are numbered consecutively across the subnets ("offsets") and the free ones are kept in a
+    virtual array. Allocating swaps a random entry with the last one and pops it, releasing appends to the end.
+    Only entries that were moved away from their initial position are stored, so even /8 subnets cost no memory
+    up front.
+    """
+
+    def __init__(self, cidrs, seed=None, reserved_head=4, reserved_tail=1, static=()):
+        """
+        :param cidrs: subnets to allocate from, e.g. ['10.0.2.0/24']
+        :param seed: seed for reproducible allocations, None seeds from the system
+        :param reserved_head: addresses at the start of every subnet that are never handed out
+            (AWS reserves the network address and the next three)
+        :param reserved_tail: addresses at the end of every subnet that are never handed out (broadcast)
+        :param static: addresses that are assigned by hand and must not be handed out
+        """
+        self.networks = [ipaddress.ip_network(cidr) for cidr in cidrs]
+        self._starts = []
+        self._first_addresses = []
+        self._size = 0
+        for network in self.networks:
+            usable = network.num_addresses - reserved_head - reserved_tail
+            if usable <= 0:
+                raise ValueError('Subnet {} has no usable addresses'.format(network))
+            self._starts.append(self._size)
+            self._first_addresses.append(int(network.network_address) + reserved_head)
+            self._size += usable
+
+        self._random = random.Random(seed)
+        self._free = self._size
+        # slot -> offset and offset -> slot, only for entries that are not at their initial slot
+        self._slots = {}
+        self._slot_of = {}
+
+        # Static addresses are taken out of the pool once and may then be assigned by hand
+        self.static = set(static)
+        self._static_in_use = set()
+        # Walk the given order, set order would make seeded allocations differ between interpreter runs
+        for address in static:
+            offset = self._to_offset(address)
+            if offset is not None and self._is_free(offset):
+                self._take(self._slot_of.get(offset, offset))
+
+    def __len__(self):
+        """ Number of addresses left. """
+        return self._free
+
+    def _offset_at(self, slot):
+        return self._slots.get(slot, slot)
+
+    def _place(self, slot, offset):
+        if slot == offset:
+            self._slots.pop(slot, None)
+            self._slot_of.pop(offset, None)
+        else:
+            self._slots[slot] = offset
+            self._slot_of[offset] = slot
+
+    def _take(self, slot):
+        offset = self._offset_at(slot)
+        last = self._free - 1
+        moved = self._offset_at(last)
+        self._slots.pop(last, None)
+        self._slot_of.pop(offset, None)
+        if slot != last:
+            self._place(slot, moved)
+        self._free -= 1
+        return offset
+
+    def _is_free(self, offset):
+        slot = self._slot_of.get(offset, offset)
+        return slot < self._free and self._offset_at(slot) == offset
+
+    def _to_address(self, offset):
+        network_id = bisect.bisect_right(self._starts, offset) - 1
+        return str(ipaddress.ip_address(self._first_addresses[network_id] + offset - self._starts[network_id]))
+
+    def _to_offset(self, address):
+        """ Returns the offset of address, or None if it is not part of any pool. """
+        address = ipaddress.ip_address(address)
+        for network_id, network in enumerate(self.networks):
+            if address in network:
+                offset = int(address) - self._first_addresses[network_id]
+                end = self._starts[network_id + 1] if network_id + 1 < len(self._starts) else self._size
+                if 0 <= offset < end - self._starts[network_id]:
+                    return self._starts[network_id] + offset
+        return None
+
+    def allocate(self):
+        """ Returns a random free address. """
+        if self._free == 0:
+            raise AddressSpaceExhausted('No addresses left in {}'.format(', '.join(map(str, self.networks))))
+        return self._to_address(self._take(self._random.randrange(self._free)))
+
+    def reserve(self, address):
+        """
+        Marks a statically assigned address as used. Addresses outside of the pools are accepted as they are.
+        :raises ValueError: if the address has already been handed out
+        """
+        if address in self.static:
+            if address in self._static_in_use:
+                raise ValueError('Address {} is already in use'.format(address))
+            self._static_in_use.add(address)
+            return address
+
+        offset = self._to_offset(address)
+        if offset is None:
+            return address
+        if not self._is_free(offset):
+            raise ValueError('Address {} is already in use'.format(address))
+        self._take(self._slot_of.get(offset, offset))
+        return address
+
+    def release(self, address):
+        """ Returns an allocated or reserved address to the pool. """
+        if address in self.static:
+            self._static_in_use.discard(address)
+            return
+
+        offset = self._to_offset(address)
+        if offset is None:
+            return
+        if self._is_free(offset):
+            raise ValueError('Address {} is not in use'.format(address))
+        self._place(self._free, offset)
+        self._free += 1
@@ -0,0 +1,165 @@
+"""
+End-to-end path properties of all machine pairs, composed from the link model of the edges.
+
+Every edge carries a delay and a jitter in ms, a loss in percent and a bandwidth in mbit/s (see edge_attrs, a
+bandwidth of None is unlimited). Along a path they compose as:
+
+    delay       sum of the link delays
+    jitter      sqrt(sum of squared link jitters), the links vary independently
+    loss        1 - prod(1 - p), summed as log(1 - p) so it is additive like delays
+    bandwidth   min of the link bandwidths, i.e. the bottleneck
+
+Trees reuse the O(N^2) walk of delay_matrix for the additive properties and find bottlenecks by merging subtrees
+along edges of decreasing bandwidth. Other graphs follow the shortest delay path from every machine.
+"""
+
+import networkx as nx
+import numpy as np
+from networkx import Graph
+
+from delay_matrix import DelayMatrix, TreeIndex, _tree_delays, compute_delay_matrix
+
+# Path properties are rounded so that equal paths end up in the same tc class
+JITTER_DIGITS = 3
+LOSS_DIGITS = 4
+# A link with 100% loss would make the log space sum infinite
+MAX_LOSS = 1 - 1e-12
+
+
+class PathMatrix(DelayMatrix):
+    """
+    DelayMatrix along with the jitter, loss and bandwidth of every machine pair. Properties that no edge of the
+    topology sets are None instead of a matrix of defaults.
+    """
+
+    def __init__(self, delays: DelayMatrix, jitter=None, loss=None, bandwidth=None):
+        super().__init__(delays.machines, delays.values)
+        self.jitter = jitter
+        self.loss = loss
+        self.bandwidth = bandwidth
+
+    def links(self, src_id, bandwidth_out):
+        """
+        Returns, for every machine, the properties of the path from src_id to it that differ from an ideal link:
+        jitter and loss if non-zero and the rate if the bottleneck is below bandwidth_out of the source.
+        """
+        links = [{} for _ in self.machines]
+        if self.jitter is not None:
+            for link, jitter in zip(links, self.jitter[src_id].tolist()):
+                if jitter > 0:
+                    link['jitter'] = jitter
+        if self.loss is not None:
+            for link, loss in zip(links, self.loss[src_id].tolist()):
+                if loss > 0:
+                    link['loss'] = loss
+        if self.bandwidth is not None:
+            for link, bandwidth in zip(links, self.bandwidth[src_id].tolist()):
+                if bandwidth < bandwidth_out:
+                    link['rate'] = _number(bandwidth)
+        return links
+
+    def has_links(self):
+        return self.jitter is not None or self.loss is not None or self.bandwidth is not None
+
+
+def _number(value):
+    return int(value) if float(value).is_integer() else value
+
+
+def _link_jitter_squared(attrs):
+    return (attrs.get('jitter') or 0) ** 2
+
+
+def _link_log_delivery(attrs):
+    return np.log1p(-min((attrs.get('loss') or 0) / 100, MAX_LOSS))
+
+
+def _link_bandwidth(attrs):
+    bandwidth = attrs.get('bandwidth')
+    return np.inf if bandwidth is None else bandwidth
+
+
+def _tree_bottlenecks(g: Graph, machines):
+    """
+    Joining two subtrees over an edge makes that edge the bottleneck between all of their machines if every edge
+    inside them is at least as wide, which holds when edges are added from the widest to the narrowest.
+    """
+    machine_ids = {machine: machine_id for machine_id, machine in enumerate(machines)}
+    values = np.full((len(machines), len(machines)), np.inf)
+    component = {node: node for node in g.nodes}
+    members = {node: [machine_ids[node]] if node in machine_ids else [] for node in g.nodes}
+
+    def find(node):
+        while component[node] != node:
+            component[node] = component[component[node]]
+            node = component[node]
+        return node
+
+    for u, v, attrs in sorted(g.edges(data=True), key=lambda edge: -_link_bandwidth(edge[2])):
+        u, v = find(u), find(v)
+        bandwidth = _link_bandwidth(attrs)
+        if members[u] and members[v] and bandwidth < np.inf:
+            values[np.ix_(members[u], members[v])] = bandwidth
+            values[np.ix_(members[v], members[u])] = bandwidth
+        if len(members[u]) < len(members[v]):
+            u, v = v, u
+        component[v] = u
+        members[u].extend(members.pop(v))
+    return values
+
+
+def _shortest_path_properties(g: Graph, machines, weights):
+    """ Composes every property along the shortest delay path from each machine, for graphs that are no tree. """
+    matrices = [np.empty((len(machines), len(machines))) for _ in weights]
+    for src_id, src in enumerate(machines):
+        predecessors, distances = nx.dijkstra_predecessor_and_distance(g, src, weight='delay')
+        values = [{src: np.inf if combine is min else 0} for _, combine in weights]
+        for node in sorted(distances, key=distances.get):
+            if node == src:
+                continue
+            predecessor = predecessors[node][0]
+            for (weight, combine), node_values in zip(weights, values):
+                node_values[node] = combine(node_values[predecessor], weight(g.edges[predecessor, node]))
+        for matrix, node_values in zip(matrices, values):
+            matrix[src_id] = [node_values[machine] for machine in machines]
+    return matrices
+
+
+def _add(a, b):
+    return a + b
+
+
+def compute_path_matrix(g: Graph, delays: DelayMatrix = None):
+    """
+    :param g: topology graph, edges carry their link model in edge_attrs
+    :param delays: the delay matrix of g if already computed, e.g. incrementally
+    :return: PathMatrix with the same machine IDs as delays
+    """
+    delays = delays if delays is not None else compute_delay_matrix(g)
+    machines = delays.machines
+    has_jitter = any(jitter for _, _, jitter in g.edges(data='jitter'))
+    has_loss = any(loss for _, _, loss in g.edges(data='loss'))
+    has_bandwidth = any(bandwidth is not None for _, _, bandwidth in g.edges(data='bandwidth'))
+    if not machines or not (has_jitter or has_loss or has_bandwidth):
+        return PathMatrix(delays)
+
+    if nx.is_tree(g):
+        tree = TreeIndex(g, machines)
+        jitter_squared = _tree_delays(g, machines, np.float64, tree, _link_jitter_squared) if has_jitter else None
+        log_delivery = _tree_delays(g, machines, np.float64, tree, _link_log_delivery) if has_loss else None
+        bandwidth = _tree_bottlenecks(g, machines) if has_bandwidth else None
+    else:
+        jitter_squared, log_delivery, bandwidth = _shortest_path_properties(
+            g, machines, [(_link_jitter_squared, _add), (_link_log_delivery, _add), (_link_bandwidth, min)])
+
+    # In place, every temporary of an N x N matrix costs as much as the walk itself
+    jitter = loss = None
+    if has_jitter:
+        jitter = np.maximum(jitter_squared, 0, out=jitter_squared)
+        np.round(np.sqrt(jitter, out=jitter), JITTER_DIGITS, out=jitter)
+    if has_loss:
+        loss = np.minimum(log_delivery, 0, out=log_delivery)
+        np.expm1(loss, out=loss)
+        np.multiply(loss, -100, out=loss)
+        np.round(loss, LOSS_DIGITS, out=loss)
+    return PathMatrix(delays, jitter, loss, bandwidth if has_bandwidth else None)
@@ -0,0 +1,81 @@
+"""
+Renders a topology for a quick sanity check.
+
+matplotlib is only imported by show(), so generating a testbed never pays for it. Trees (which validate_graph
+enforces) are laid out level by level in O(N) instead of with the O(N^2) spring layout. write_dot() exports the
+graph for Graphviz, e.g. `dot -Tsvg testbed.dot -o testbed.svg`, which handles thousands of nodes.
+"""
+
+import json
+
+import networkx as nx
+from networkx import Graph
+
+# Node labels are unreadable beyond this many nodes and only slow down drawing
+MAX_LABELED_NODES = 200
+
+
+def tree_layout(g: Graph, root=None):
+    """
+    Places the root at the top and every other node one level below its parent. Leaves are spread evenly from left
+    to right in preorder, inner nodes are centered above their children.
+    :return: node -> (x, y)
+    """
+    root = next(iter(g.nodes)) if root is None else root
+    parent = {root: None}
+    depth = {root: 0}
+    preorder = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        preorder.append(node)
+        for neighbor in g.adj[node]:
+            if neighbor not in parent:
+                parent[neighbor] = node
+                depth[neighbor] = depth[node] + 1
+                stack.append(neighbor)
+
+    children = {node: [] for node in preorder}
+    for node in preorder[1:]:
+        children[parent[node]].append(node)
+
+    x = {}
+    leaves = 0
+    for node in preorder:
+        if not children[node]:
+            x[node] = leaves
+            leaves += 1
+    for node in reversed(preorder):
+        if children[node]:
+            x[node] = sum(x[child] for child in children[node]) / len(children[node])
+    return {node: (x[node], -depth[node]) for node in preorder}
+
+
+def show(g: Graph):
+    """ Draws the topology in a matplotlib window, zones in gray. """
+    from matplotlib import pyplot as plt
+
+    pos = tree_layout(g) if nx.is_tree(g) else nx.spring_layout(g)
+    colors = ['lightgray' if attrs['type'] == 'zone' else 'tab:blue' for _, attrs in g.nodes(data=True)]
+    labeled = g.number_of_nodes() <= MAX_LABELED_NODES
+    nx.draw_networkx(g, pos, node_color=colors, with_labels=labeled, node_size=300 if labeled else 10)
+    plt.show()
+
+
+def _quote(value):
+    # JSON string escapes are valid DOT string escapes
+    return json.dumps(str(value))
+
+
+def write_dot(g: Graph, path):
+    """ Writes the topology as Graphviz DOT, edges are labeled with their delay. """
+    with open(path, 'w') as file:
+        file.write('graph testbed {\n')
+        file.write('  node [shape=box];\n')
+        for node, attrs in g.nodes(data=True):
+            label = node if attrs['type'] == 'zone' else '{}\\n{}'.format(node, attrs['internal_ip'])
+            style = ' style=dashed' if attrs['type'] == 'zone' else ''
+            file.write('  {} [label="{}"{}];\n'.format(_quote(node), label.replace('"', '\\"'), style))
+        for u, v, delay in g.edges(data='delay', default=0):
+            file.write('  {} -- {} [label="{}ms"];\n'.format(_quote(u), _quote(v), delay))
+        file.write('}\n')
@@ -1,6 +1,8 @@
+import random
+
 from networkx.classes import Graph
 
-from common import node_attrs, edge_attrs, app_config
+from common import configure_ip_allocator, node_attrs, edge_attrs, app_config
 
 
 def simple_topology(g: Graph):
@@ -17,3 +19,79 @@ def simple_topology(g: Graph):
     g.add_edge('cloud1_broker1', 'cloud1', **edge_attrs(delay=4))
     g.add_edge('cloud1_client1', 'cloud1', **edge_attrs(delay=2))
     g.add_edge('cloud1_client2', 'cloud1', **edge_attrs(delay=2))
+
+
+# Tiers of a fog hierarchy from the cloud down to the devices. Each machine of a tier is connected to a random
+# machine of the tier above over a link with a delay drawn from 'delay' and, if given, a jitter, loss and bandwidth
+# drawn from 'jitter', 'loss' and 'bandwidth' (see edge_attrs), 'bandwidth_out' is drawn per machine.
+FOG_TIERS = [
+    {'role': 'cloud', 'fan_out': 2, 'flavor': 't3.large', 'delay': (20, 60), 'bandwidth_out': (100000, 100000)},
+    {'role': 'regional', 'fan_out': 5, 'flavor': 't3.medium', 'delay': (5, 20), 'bandwidth_out': (10000, 50000)},
+    {'role': 'edge', 'fan_out': 10, 'flavor': 't3.small', 'delay': (1, 5), 'bandwidth_out': (1000, 10000),
+     'bandwidth': (500, 5000)},
+    {'role': 'device', 'fan_out': 10, 'flavor': 't3.nano', 'delay': (1, 10), 'bandwidth_out': (100, 1000),
+     'jitter': (0, 2), 'loss': (0, 1), 'bandwidth': (10, 100)},
+]
+DEFAULT_IMAGE = 'ami-05da26ff253f6c5df'
+# Internal subnet for generated testbeds, large enough for 32k machines. mockfog_topology has to create it with
+# internal_subnet_cidr: 10.0.128.0/17, it lies in the VPC (10.0.0.0/16) apart from the management subnet (10.0.1.0/24).
+GENERATOR_CIDRS = ['10.0.128.0/17']
+
+
+def _draw_link(rng, tier):
+    link = {'delay': rng.randint(*tier['delay'])}
+    if 'jitter' in tier:
+        link['jitter'] = round(rng.uniform(*tier['jitter']), 1)
+    if 'loss' in tier:
+        link['loss'] = round(rng.uniform(*tier['loss']), 2)
+    if 'bandwidth' in tier:
+        link['bandwidth'] = rng.randint(*tier['bandwidth'])
+    return link
+
+
+def fog_hierarchy(g: Graph, tiers=None, seed=None, image=DEFAULT_IMAGE, cidrs=None):
+    """
+    Generates a cloud -> regional -> edge -> device tree below a single 'cloud' zone.
+
+    Every machine of a tier has fan_out children in the next tier on average, the parents are drawn at random so
+    the tree is not perfectly balanced. The default tiers give 2 + 10 + 100 + 1000 machines, larger fan-outs
+    scale to 10k+ machines in seconds.
+    :param tiers: list of tiers like FOG_TIERS, top tier first
+    :param seed: seed for delays, bandwidths, parents and IP addresses, None for a different testbed every time
+    :param image: AMI of all machines
+    :param cidrs: subnets to allocate internal IPs from, GENERATOR_CIDRS by default
+    """
+    rng = random.Random(seed)
+    configure_ip_allocator(cidrs or GENERATOR_CIDRS, seed=seed)
+    g.add_node('cloud', **node_attrs(type='zone'))
+
+    parents = ['cloud']
+    for tier in tiers or FOG_TIERS:
+        machines = []
+        for machine_id in range(len(parents) * tier['fan_out']):
+            name = '{}{}'.format(tier['role'], machine_id + 1)
+            # Spread the first children evenly so every parent gets at least one, the rest at random
+            parent = parents[machine_id] if machine_id < len(parents) else rng.choice(parents)
+            g.add_node(name, **node_attrs(role=tier['role'], flavor=tier['flavor'], image=image,
+                                          bandwidth_out=rng.randint(*tier['bandwidth_out'])))
+            g.add_edge(parent, name, **edge_attrs(**_draw_link(rng, tier)))
+            machines.append(name)
+        parents = machines
+
+
+def random_tree(g: Graph, machines, fan_out=10, delay=(1, 20), seed=None, image=DEFAULT_IMAGE, cidrs=None):
+    """
+    Generates a random tree of machines below a single 'cloud' zone, every machine has at most fan_out children.
+    :param machines: number of machines
+    :param delay: range of link delays
+    """
+    rng = random.Random(seed)
+    configure_ip_allocator(cidrs or GENERATOR_CIDRS, seed=seed)
+    g.add_node('cloud', **node_attrs(type='zone'))
+
+    parents = ['cloud']
+    for machine_id in range(machines):
+        name = 'machine{}'.format(machine_id)
+        g.add_node(name, **node_attrs(role='machine', image=image))
+        g.add_edge(parents[machine_id // fan_out], name, **edge_attrs(delay=rng.randint(*delay)))
+        parents.append(name)